@@ -1,4 +1,20 @@
 import os
+import argparse
+import contextlib
+import copy
+import json
+import atexit
+import glob
+import gzip
+import queue
+import random
+import re
+import resource
+import shutil
+import smtplib
+import sqlite3
+import tempfile
+import urllib.request
 import socket
 import subprocess
 import time
@@ -6,8 +22,41 @@ import threading
 import signal
 import sys
 import datetime
+import heapq
+import bisect
+import errno
+import itertools
+import selectors
+import shlex
+from collections import deque, namedtuple
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 from termcolor import colored
 
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+try:
+    import curses
+except ImportError:
+    curses = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import toml as tomllib
+    except ImportError:
+        tomllib = None
+
 SERVICES_CONFIG = {
     "ssh": {
         "service_name": "sshd",
@@ -59,9 +108,155 @@ SERVICES_CONFIG = {
     }
 }
 
-monitored_services = {}
+DEFAULT_SERVICES_CONFIG = copy.deepcopy(SERVICES_CONFIG)
+
+ServiceSnapshot = namedtuple("ServiceSnapshot", [
+    "name", "status", "last_check", "last_restart", "restart_count", "failures", "interval",
+    "check_latencies",
+])
+
+class ServiceState:
+    # Mutated only by the worker running the service's check; readers go
+    # through snapshot() instead of touching the live object.
+    __slots__ = (
+        "name", "status", "last_check", "last_restart", "restart_count", "restart_attempts",
+        "failures", "interval", "last_ok_at", "event_exit_at", "cancelled", "check_latencies",
+        "healthy_streak", "latency_baseline", "last_failure_at",
+    )
+    
+    def __init__(self, name, status, interval):
+        self.name = name
+        self.status = status
+        self.last_check = time.time()
+        self.last_restart = None
+        self.restart_count = 0
+        self.restart_attempts = 0
+        self.failures = 0
+        self.interval = interval
+        self.last_ok_at = None
+        self.event_exit_at = None
+        self.cancelled = threading.Event()
+        self.check_latencies = deque(maxlen=CHECK_LATENCY_HISTORY)
+        self.healthy_streak = 0
+        self.latency_baseline = None
+        self.last_failure_at = None
+    
+    def snapshot(self):
+        return ServiceSnapshot(self.name, self.status, self.last_check, self.last_restart,
+                               self.restart_count, self.failures, self.interval,
+                               tuple(self.check_latencies))
+
+class ServiceStore:
+    # Copy-on-write map of service name to ServiceState. Writers swap in a new
+    # dict under the lock, so readers can iterate without locking and never
+    # see it change size underneath them.
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.services = {}
+    
+    def add(self, state):
+        with self.lock:
+            services = dict(self.services)
+            previous = services.get(state.name)
+            services[state.name] = state
+            self.services = services
+        if previous is not None:
+            previous.cancelled.set()
+    
+    def remove(self, name):
+        with self.lock:
+            services = dict(self.services)
+            state = services.pop(name, None)
+            self.services = services
+        if state is not None:
+            state.cancelled.set()
+        return state
+    
+    def get(self, name):
+        return self.services.get(name)
+    
+    def snapshot(self):
+        return [state.snapshot() for state in self.services.values()]
+    
+    def __contains__(self, name):
+        return name in self.services
+    
+    def __iter__(self):
+        return iter(self.services)
+    
+    def __len__(self):
+        return len(self.services)
+
+def format_timestamp(timestamp, default="Never"):
+    if timestamp is None:
+        return default
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+monitored_services = ServiceStore()
 log_file = "service_monitor.log"
+state_db_file = "service_monitor.db"
 stop_event = threading.Event()
+console_muted = threading.Event()  # Set while curses owns the terminal
+CHECK_WORKERS = 8
+CHECK_WORKERS_MAX = 256
+CHECK_WORKER_IDLE = 60
+BATCH_CACHE_TTL = 2
+EVENT_POLL_MULTIPLIER = 4
+EVENT_RECHECK_DELAY = 2
+HEALTH_PROBE_MAX_RESPONSE = 65536
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.5
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+LOG_BACKUP_COUNT = 7
+LOG_INDEX_SUFFIX = ".idx"
+LOG_INDEX_STRIDE = 64 * 1024
+RESTART_HISTORY_DAYS = 365
+METRICS_REFRESH_INTERVAL = 1
+DASHBOARD_REFRESH_MS = 500
+DASHBOARD_LOG_LINES = 5
+CHECK_LATENCY_HISTORY = 20
+RESTART_CONCURRENCY = 2
+RESTART_GROUP_CONCURRENCY = 1
+RESTART_BACKOFF_BASE = 10
+RESTART_BACKOFF_MAX = 300
+RESTART_RETRY_DELAY = 5
+ADAPTIVE_WARMUP = 3
+ADAPTIVE_GROWTH = 1.25
+ADAPTIVE_MAX_FACTOR = 8
+ADAPTIVE_DRIFT_FACTOR = 2
+ADAPTIVE_DRIFT_MIN = 0.05
+ADAPTIVE_SMOOTHING = 0.2
+ADAPTIVE_FAILURE_MEMORY = 10
+ADAPTIVE_FAILURE_FACTOR = 0.5
+MAX_CHECKS_PER_SECOND = 50
+SSH_COMMAND = ["ssh"]
+SSH_HOST_CONCURRENCY = 4
+SSH_CONTROL_PERSIST = 600
+SSH_CONNECT_TIMEOUT = 10
+AGENT_BATCH_INTERVAL = 1
+AGENT_HEARTBEAT_INTERVAL = 15
+AGENT_RESEND_BUFFER = 1000
+AGENT_CONNECT_TIMEOUT = 10
+AGENT_RECONNECT_MAX = 30
+AGGREGATOR_BACKLOG = 1024
+NOTIFY_QUEUE_SIZE = 1000
+NOTIFY_COALESCE_WINDOW = 30
+NOTIFY_DEDUP_WINDOW = 300
+NOTIFY_RATE_LIMIT = 10
+TRACE_HISTORY = 100
+PROFILE_INTERVAL = 0.01
+COMMAND_CONCURRENCY = 16
+COMMAND_TIMEOUT = 30
+RESTART_COMMAND_TIMEOUT = 120
+COMMAND_OUTPUT_LIMIT = 64 * 1024
+COMMAND_DRAIN_GRACE = 0.5
+SHELL_METACHARACTERS = re.compile(r"[|&;<>()$`\\*?\[\]{}~#!\n]")
+check_durations = {}
+detection_latency = {"event": deque(maxlen=100), "poll": deque(maxlen=100)}
+recent_log_entries = deque(maxlen=DASHBOARD_LOG_LINES)
 
 def print_ascii_art():
     ascii_art = """
@@ -76,188 +271,3004 @@ def print_ascii_art():
     print(colored("Service Monitor & Auto-Restarter v1.0", 'green'))
     print(colored("-" * 70, 'white'))
 
-def clear_screen():
-    os.system('clear')
+def clear_screen():
+    os.system('clear')
+
+CheckTrace = namedtuple("CheckTrace", ["service", "at", "lateness", "total", "phases"])
+
+check_trace = threading.local()
+check_traces = {}
+
+@contextlib.contextmanager
+def trace_phase(phase):
+    # Adds the time spent in the block to the running check's trace, if any.
+    # Phases nest (a port probe can log), so each records only its self time
+    # and the phases of a check never add up to more than its total.
+    phases = getattr(check_trace, "phases", None)
+    if phases is None:
+        yield
+        return
+    nested = check_trace.nested
+    nested.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        phases[phase] = phases.get(phase, 0) + elapsed - nested.pop()
+        if nested:
+            nested[-1] += elapsed
+
+def begin_check_trace():
+    check_trace.phases = {}
+    check_trace.nested = []
+    check_trace.started = time.perf_counter()
+
+def end_check_trace(service_name, lateness):
+    phases = check_trace.phases
+    total = time.perf_counter() - check_trace.started
+    check_trace.phases = None
+    
+    # Whatever no phase claimed is bookkeeping: state updates, restarts' waits, etc.
+    phases["state"] = max(0.0, total - sum(phases.values()))
+    traces = check_traces.get(service_name)
+    if traces is None:
+        traces = check_traces.setdefault(service_name, deque(maxlen=TRACE_HISTORY))
+    traces.append(CheckTrace(service_name, time.time(), lateness, total, phases))
+
+class LogWriter:
+    # Single background writer for the log file. Callers only enqueue lines,
+    # so a slow disk or a rotation can never stall a check; when the queue is
+    # full the line is dropped and counted instead.
+    
+    def __init__(self, max_queue=LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = None
+        self.index = None
+        self.last_indexed = None
+        self.path = None
+        self.opened_at = None
+        self.dropped = 0
+        self.reported_dropped = 0
+    
+    def write(self, line):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="log-writer")
+                self.thread.daemon = True
+                self.thread.start()
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+    
+    def _open(self):
+        self.path = log_file
+        self.file = open(self.path, "a")
+        self.index = open(self.path + LOG_INDEX_SUFFIX, "a")
+        self.last_indexed = None
+        self.opened_at = time.time()
+    
+    def _close_files(self):
+        for handle in (self.file, self.index):
+            if handle is not None:
+                handle.close()
+        self.file = None
+        self.index = None
+    
+    def _should_rotate(self):
+        return (self.file.tell() >= LOG_MAX_BYTES or
+                time.time() - self.opened_at >= LOG_ROTATE_INTERVAL)
+    
+    def _rotate(self):
+        self._close_files()
+        rotated = "{}.{}".format(self.path, datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+        os.rename(self.path, rotated)
+        os.rename(self.path + LOG_INDEX_SUFFIX, rotated + LOG_INDEX_SUFFIX)
+        
+        with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+        
+        for old_segment in rotated_log_segments(self.path)[:-LOG_BACKUP_COUNT]:
+            os.remove(old_segment)
+            if os.path.exists(log_index_path(old_segment)):
+                os.remove(log_index_path(old_segment))
+        
+        self._open()
+    
+    def _flush(self, lines):
+        if self.file is None or self.path != log_file:
+            self._close_files()
+            self._open()
+        
+        if self.dropped != self.reported_dropped:
+            dropped = self.dropped - self.reported_dropped
+            self.reported_dropped = self.dropped
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(f"{timestamp} [WARNING] Log queue full, dropped {dropped} messages")
+        
+        offset = self.file.tell()
+        if self.last_indexed is None or offset - self.last_indexed >= LOG_INDEX_STRIDE:
+            # Batches start on a line boundary, so the offset is always a line start.
+            self.index.write(f"{lines[0][:19]}\t{offset}\n")
+            self.index.flush()
+            self.last_indexed = offset
+        
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        
+        if self._should_rotate():
+            self._rotate()
+    
+    def run(self):
+        while True:
+            lines = [self.queue.get()]
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(lines) < LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    lines.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            taken = len(lines)
+            try:
+                self._flush(lines)
+            except OSError as e:
+                print(colored(f"Cannot write log file {log_file}: {str(e)}", 'red'))
+                self._close_files()
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+    
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+        self._close_files()
+
+log_writer = LogWriter()
+atexit.register(log_writer.close)
+
+def rotated_log_segments(path):
+    return sorted(glob.glob(glob.escape(path) + ".*.gz"))
+
+def log_segments(path):
+    segments = rotated_log_segments(path)
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+def log_index_path(segment):
+    if segment.endswith(".gz"):
+        segment = segment[:-3]
+    return segment + LOG_INDEX_SUFFIX
+
+def read_log_index(segment):
+    entries = []
+    try:
+        with open(log_index_path(segment)) as f:
+            for line in f:
+                timestamp, _, offset = line.rstrip("\n").partition("\t")
+                if offset.isdigit():
+                    entries.append((timestamp, int(offset)))
+    except FileNotFoundError:
+        pass
+    return entries
+
+def tail_lines(path, count, block_size=8192):
+    # Reads backwards from the end so only the last few blocks are touched.
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    
+    return [line.decode("utf-8", "replace") for line in data.splitlines()[-count:]]
+
+def query_log(service=None, level=None, since=None, until=None, limit=200):
+    # Timestamps are "%Y-%m-%d %H:%M:%S" strings, which sort chronologically,
+    # so the sidecar index can be searched and compared without parsing.
+    service_pattern = re.compile(r"\b{}\b".format(re.escape(service))) if service else None
+    level_tag = f"[{level.upper()}]" if level else None
+    
+    segments = log_segments(log_file)
+    indexes = [read_log_index(segment) for segment in segments]
+    matches = []
+    
+    for position, segment in enumerate(segments):
+        index = indexes[position]
+        next_index = indexes[position + 1] if position + 1 < len(indexes) else None
+        
+        if until and index and index[0][0] > until:
+            break
+        if since and next_index and next_index[0][0] < since:
+            continue  # The whole segment ends before the requested range
+        
+        start = 0
+        if since and index:
+            keys = [timestamp for timestamp, _ in index]
+            found = bisect.bisect_left(keys, since) - 1
+            if found >= 0:
+                start = index[found][1]
+        
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rb") as f:
+            f.seek(start)
+            for raw in f:
+                line = raw.decode("utf-8", "replace").rstrip("\n")
+                timestamp = line[:19]
+                if since and timestamp < since:
+                    continue
+                if until and timestamp > until:
+                    return matches
+                if level_tag and line[20:20 + len(level_tag)] != level_tag:
+                    continue
+                if service_pattern and not service_pattern.search(line[20:]):
+                    continue
+                
+                matches.append(line)
+                if limit and len(matches) >= limit:
+                    return matches
+    
+    return matches
+
+def log_message(message, level="INFO"):
+    with trace_phase("log"):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log_entry = f"{timestamp} [{level}] {message}"
+        
+        log_writer.write(log_entry)
+        recent_log_entries.append((level, log_entry))
+        
+        if console_muted.is_set():
+            return  # Shown in the dashboard's log pane instead
+        if level == "ERROR":
+            print(colored(log_entry, 'red'))
+        elif level == "WARNING":
+            print(colored(log_entry, 'yellow'))
+        elif level == "SUCCESS":
+            print(colored(log_entry, 'green'))
+        else:
+            print(colored(log_entry, 'white'))
+
+class SSHConnectionPool:
+    # Runs commands on remote hosts over one multiplexed OpenSSH connection
+    # per host (ControlMaster), with a cap on concurrent commands per host.
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.commands = {}
+        self.control_dir = None
+    
+    def _slot(self, host):
+        with self.lock:
+            if self.control_dir is None:
+                self.control_dir = tempfile.mkdtemp(prefix="service-monitor-ssh-")
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(SSH_HOST_CONCURRENCY)
+                self.commands[host] = 0
+            self.commands[host] += 1
+            return self.slots[host]
+    
+    def _options(self):
+        return [
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_dir}/%C",
+            "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+            "-o", "BatchMode=yes",
+            "-o", f"ConnectTimeout={SSH_CONNECT_TIMEOUT}",
+        ]
+    
+    def run(self, host, command, timeout):
+        with self._slot(host):
+            # ssh exits with 255 for its own errors, otherwise with the remote status
+            return command_runner.run_argv(SSH_COMMAND + self._options() + [host, command],
+                                           timeout + SSH_CONNECT_TIMEOUT)
+    
+    def close(self):
+        with self.lock:
+            hosts = list(self.slots)
+            control_dir, self.control_dir = self.control_dir, None
+        if control_dir is None:
+            return
+        
+        for host in hosts:
+            subprocess.run(SSH_COMMAND + ["-o", f"ControlPath={control_dir}/%C", "-O", "exit", host],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+ssh_pool = SSHConnectionPool()
+atexit.register(ssh_pool.close)
+
+def remote_hostname(remote):
+    return remote.rsplit("@", 1)[-1]
+
+def service_host(config):
+    if config.get("host"):
+        return config["host"]
+    if config.get("remote"):
+        return remote_hostname(config["remote"])
+    return "127.0.0.1"
+
+def run_service_command(config, command, timeout=None):
+    timeout = timeout or config.get("command_timeout", COMMAND_TIMEOUT)
+    if config.get("remote"):
+        return ssh_pool.run(config["remote"], command, timeout)
+    return execute_command(command, timeout)
+
+class LatencyHistogram:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+    
+    def percentile(self, fraction):
+        # Returns the upper bound of the bucket holding the requested rank.
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class CommandRunner:
+    # Runs local commands without an intermediate shell when they are a plain
+    # argv, each in its own process group so a timeout kills the whole tree.
+    # Captured output is capped and at most COMMAND_CONCURRENCY commands run
+    # at once; the rest queue for a slot.
+    
+    def __init__(self):
+        self.slots = threading.BoundedSemaphore(COMMAND_CONCURRENCY)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.timeouts = 0
+        self.truncated = 0
+        self.latency = LatencyHistogram()
+    
+    def argv(self, command):
+        if not SHELL_METACHARACTERS.search(command):
+            try:
+                argv = shlex.split(command)
+            except ValueError:
+                argv = None
+            # A leading NAME=value is a shell variable assignment, and a name not
+            # found on PATH may be a shell builtin such as `command` or `exit`.
+            if argv and "=" not in argv[0] and shutil.which(argv[0]):
+                return argv
+        return ["/bin/sh", "-c", command]
+    
+    def run(self, command, timeout):
+        return self.run_argv(self.argv(command), timeout)
+    
+    def run_argv(self, argv, timeout):
+        with self.lock:
+            self.waiting += 1
+        with trace_phase("queue"):
+            self.slots.acquire()
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        
+        started = time.perf_counter()
+        try:
+            return self._execute(argv, timeout)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.latency.observe(time.perf_counter() - started)
+            self.slots.release()
+    
+    def _execute(self, argv, timeout):
+        try:
+            with trace_phase("spawn"):
+                process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE, start_new_session=True)
+        except OSError as e:
+            # Same exit codes the shell uses for missing and non-executable commands
+            return (127 if isinstance(e, FileNotFoundError) else 126), "", str(e)
+        
+        with trace_phase("command"):
+            try:
+                outputs, dropped, timed_out = self._collect(process, time.monotonic() + timeout)
+            finally:
+                process.stdout.close()
+                process.stderr.close()
+        
+        stdout, stderr = (outputs[pipe].decode(errors="replace") for pipe in (process.stdout, process.stderr))
+        if dropped[process.stdout] or dropped[process.stderr]:
+            with self.lock:
+                self.truncated += 1
+            if dropped[process.stdout]:
+                stdout += f"\n[{dropped[process.stdout]} bytes of output truncated]"
+            if dropped[process.stderr]:
+                stderr += f"\n[{dropped[process.stderr]} bytes of output truncated]"
+        
+        if timed_out:
+            with self.lock:
+                self.timeouts += 1
+            return 124, stdout, (stderr + f"\nCommand timed out after {timeout}s").lstrip("\n")
+        return process.returncode, stdout, stderr
+    
+    def _collect(self, process, deadline):
+        outputs = {process.stdout: bytearray(), process.stderr: bytearray()}
+        dropped = {process.stdout: 0, process.stderr: 0}
+        
+        with selectors.DefaultSelector() as selector:
+            for pipe in outputs:
+                selector.register(pipe, selectors.EVENT_READ)
+            
+            exited = False
+            while selector.get_map():
+                if not exited and process.poll() is not None:
+                    # Background children can hold the pipes open long after the
+                    # command itself exits; give them a moment, then stop reading.
+                    exited = True
+                    deadline = min(deadline, time.monotonic() + COMMAND_DRAIN_GRACE)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(min(remaining, COMMAND_DRAIN_GRACE)):
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    # Keep draining past the cap so the command never blocks on a full pipe.
+                    output = outputs[key.fileobj]
+                    kept = chunk[:max(0, COMMAND_OUTPUT_LIMIT - len(output))]
+                    output += kept
+                    dropped[key.fileobj] += len(chunk) - len(kept)
+        
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+            return outputs, dropped, False
+        except subprocess.TimeoutExpired:
+            pass
+        
+        # The command leads its own process group, so this also kills whatever it spawned.
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        return outputs, dropped, True
+
+command_runner = CommandRunner()
+
+def execute_command(command, timeout=None):
+    return command_runner.run(command, timeout or COMMAND_TIMEOUT)
+
+class PortProbe:
+    def __init__(self, host, port, family, address, timeout):
+        self.host = host
+        self.port = port
+        self.family = family
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.started = None
+        self.deadline = None
+        self.result = False
+        self.timed_out = False
+        self.latency = None
+        self.final = True
+        self.done = threading.Event()
+
+class PortProber:
+    # Multiplexes non-blocking connects from every check onto one selector
+    # thread, so a dark port only costs its own timeout and concurrent checks
+    # probe in parallel.
+    
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.in_flight = {}
+        self.stats = {}
+        self.thread = None
+        self.waker = None
+    
+    def _start(self):
+        # Called with the lock held.
+        if self.thread and self.thread.is_alive():
+            return
+        if self.waker is None:
+            self.waker = socket.socketpair()
+            self.waker[0].setblocking(False)
+            self.selector.register(self.waker[0], selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, name="port-prober")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def probe(self, host, port, timeout=1):
+        try:
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            log_message(f"Cannot resolve {host}: {str(e)}", "WARNING")
+            return False
+        
+        # A name can resolve IPv6 first while the service only listens on
+        # IPv4 (or the reverse), so every address is tried before giving up.
+        addresses = list(dict.fromkeys((family, address) for family, _, _, _, address in addresses))
+        for index, (family, address) in enumerate(addresses):
+            probe = PortProbe(host, port, family, address, timeout)
+            probe.final = index == len(addresses) - 1
+            with self.lock:
+                self.incoming.append(probe)
+                self._start()
+            self.waker[1].send(b"\0")
+            
+            probe.done.wait(timeout + 1)
+            if probe.result:
+                return True
+        return False
+    
+    def _begin(self, probe):
+        probe.started = time.monotonic()
+        probe.deadline = probe.started + probe.timeout
+        try:
+            probe.sock = socket.socket(probe.family, socket.SOCK_STREAM)
+            probe.sock.setblocking(False)
+            error = probe.sock.connect_ex(probe.address)
+        except OSError as e:
+            error = e.errno
+        
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.selector.register(probe.sock, selectors.EVENT_WRITE, probe)
+            self.in_flight[probe.sock] = probe
+        else:
+            self._finish(probe, error == 0)
+    
+    def _finish(self, probe, is_open, timed_out=False):
+        probe.latency = time.monotonic() - probe.started
+        probe.result = is_open
+        probe.timed_out = timed_out
+        if probe.sock is not None:
+            if self.in_flight.pop(probe.sock, None) is not None:
+                self.selector.unregister(probe.sock)
+            probe.sock.close()
+        
+        if not is_open and not probe.final:
+            probe.done.set()
+            return  # Only the outcome of the last address counts as closed
+        
+        stats = self.stats.get((probe.host, probe.port))
+        if stats is None:
+            stats = {"histogram": LatencyHistogram(), "open": 0, "closed": 0, "timeouts": 0}
+            self.stats[(probe.host, probe.port)] = stats
+        if is_open:
+            stats["open"] += 1
+            stats["histogram"].observe(probe.latency)
+        elif timed_out:
+            stats["timeouts"] += 1
+        else:
+            stats["closed"] += 1
+        
+        probe.done.set()
+    
+    def run(self):
+        while True:
+            with self.lock:
+                incoming, self.incoming = self.incoming, []
+            for probe in incoming:
+                self._begin(probe)
+            
+            timeout = None
+            if self.in_flight:
+                timeout = max(0, min(p.deadline for p in self.in_flight.values()) - time.monotonic())
+            
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self.waker[0].recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                
+                error = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                self._finish(key.data, error == 0)
+            
+            now = time.monotonic()
+            for probe in [p for p in self.in_flight.values() if p.deadline <= now]:
+                self._finish(probe, False, timed_out=True)
+    
+    def connect_latency(self, host, port):
+        stats = self.stats.get((host, port))
+        return stats["histogram"] if stats else None
+
+port_prober = PortProber()
+
+def is_port_open(host, port, timeout=1):
+    if port is None:
+        return None
+    
+    with trace_phase("port"):
+        return port_prober.probe(host, port, timeout)
+
+def systemd_unit_name(service_name):
+    return service_name if "." in service_name else f"{service_name}.service"
+
+class SystemdStatusBackend:
+    # Reads unit ActiveState/SubState/MainPID over one shared D-Bus connection when
+    # dbus-python is available, otherwise from a single `systemctl show` call.
+    
+    PROPERTIES = ("LoadState", "ActiveState", "SubState", "MainPID")
+    UNIT_PROPERTIES = ("LoadState", "ActiveState", "SubState")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bus = None
+        self.manager = None
+        self.dbus_failed = False
+    
+    def _connect(self):
+        if dbus is None or self.dbus_failed:
+            return False
+        if self.manager is not None:
+            return True
+        
+        try:
+            self.bus = dbus.SystemBus()
+            systemd = self.bus.get_object("org.freedesktop.systemd1", "/org/freedesktop/systemd1")
+            self.manager = dbus.Interface(systemd, "org.freedesktop.systemd1.Manager")
+            return True
+        except dbus.DBusException as e:
+            log_message(f"D-Bus unavailable, falling back to systemctl show: {str(e)}", "WARNING")
+            self.dbus_failed = True
+            return False
+    
+    def _query_dbus(self, units):
+        states = {}
+        for unit in units:
+            # One round trip per interface rather than one per property.
+            unit_object = self.bus.get_object("org.freedesktop.systemd1", self.manager.LoadUnit(unit))
+            properties = dbus.Interface(unit_object, "org.freedesktop.DBus.Properties")
+            values = properties.GetAll("org.freedesktop.systemd1.Unit")
+            states[unit] = {name: str(values.get(name, "")) for name in self.UNIT_PROPERTIES}
+            if unit.endswith(".service"):
+                values = properties.GetAll("org.freedesktop.systemd1.Service")
+                states[unit]["MainPID"] = str(values.get("MainPID", 0))
+        return states
+    
+    def _query_systemctl(self, units):
+        command = "systemctl show -p {} {}".format(
+            ",".join(self.PROPERTIES), " ".join(shlex.quote(unit) for unit in units))
+        returncode, stdout, stderr = execute_command(command)
+        if returncode != 0:
+            raise RuntimeError(stderr.strip() or f"systemctl show exited with {returncode}")
+        return dict(zip(units, parse_systemctl_show(stdout)))
+    
+    def get_unit_states(self, units):
+        units = [systemd_unit_name(unit) for unit in units]
+        with self.lock:
+            if self._connect():
+                try:
+                    return self._query_dbus(units)
+                except dbus.DBusException as e:
+                    log_message(f"D-Bus query failed, reconnecting on next check: {str(e)}", "WARNING")
+                    self.manager = None
+        return self._query_systemctl(units)
+    
+    def get_unit_state(self, unit):
+        return self.get_unit_states([unit]).get(systemd_unit_name(unit))
+
+def parse_systemctl_show(output):
+    # `systemctl show` prints one block of Key=Value lines per unit, in argument order.
+    blocks = []
+    current = {}
+    for line in output.splitlines():
+        if not line.strip():
+            if current:
+                blocks.append(current)
+                current = {}
+            continue
+        key, _, value = line.partition("=")
+        current[key] = value
+    if current:
+        blocks.append(current)
+    return blocks
+
+systemd_backend = SystemdStatusBackend()
+
+class StatusBatchCollector:
+    # Answers unit state lookups from one batched query shared by every
+    # monitored systemd-backed service, cached briefly so checks whose
+    # intervals line up reuse the same result.
+    
+    def __init__(self, backend, ttl=BATCH_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.isolated = set()
+        self.lookups = 0
+        self.queries = 0
+    
+    def _batch_units(self, unit):
+        units = {systemd_unit_name(unit)}
+        if units <= self.isolated:
+            return sorted(units)  # Known to break batches; queried on its own
+        for service_name in list(monitored_services):
+            config = SERVICES_CONFIG.get(service_name)
+            if config and (config.get("status_backend") == "systemd" or config.get("event_detection") or
+                           (config.get("resource_limits") and not config.get("pid_file"))):
+                units.add(systemd_unit_name(config["service_name"]))
+        return sorted(units - self.isolated)
+    
+    def _query_separately(self, units):
+        # Called with the lock held after a batched query failed, so one bad
+        # unit only fails its own service's check.
+        states = {}
+        errors = {}
+        for unit in units:
+            try:
+                states.update(self.backend.get_unit_states([unit]))
+                self.queries += 1
+            except Exception as e:
+                errors[unit] = e
+                self.isolated.add(unit)
+        return states, errors
+    
+    def get_unit_state(self, unit):
+        unit = systemd_unit_name(unit)
+        with self.lock:
+            self.lookups += 1
+            cached = self.cache.get(unit)
+            if cached and time.monotonic() - cached[1] < self.ttl:
+                return cached[0]
+            
+            # Holding the lock while querying lets concurrent checks wait for
+            # this result instead of forking their own systemctl.
+            units = self._batch_units(unit)
+            try:
+                states = self.backend.get_unit_states(units)
+                self.queries += 1
+                errors = {}
+            except Exception as e:
+                if len(units) > 1:
+                    log_message(f"Batched unit query failed, querying {len(units)} units separately: {str(e)}", "WARNING")
+                    states, errors = self._query_separately(units)
+                else:
+                    states, errors = {}, {unit: e}
+            
+            fetched_at = time.monotonic()
+            for name, state in states.items():
+                self.cache[name] = (state, fetched_at)
+            if unit in errors:
+                raise errors[unit]
+            self.isolated.discard(unit)  # Batched again once it answers
+            return states.get(unit)
+    
+    def forks_saved(self):
+        return self.lookups - self.queries
+
+status_collector = StatusBatchCollector(systemd_backend)
+
+def check_unit_status(config):
+    try:
+        state = status_collector.get_unit_state(config["service_name"])
+    except Exception as e:
+        return 1, "", str(e)
+    
+    if not state:
+        return 1, "", f"No state returned for {config['service_name']}"
+    
+    summary = "{} ({}/{})".format(state.get("LoadState", "unknown"), state.get("ActiveState", "unknown"), state.get("SubState", "unknown"))
+    if state.get("ActiveState") == "active":
+        return 0, summary, ""
+    return 3, "", f"Unit {config['service_name']} is {summary}"
+
+def recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        data += chunk
+    return data
+
+def probe_http(sock, host, options):
+    path = options.get("path", "/")
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {options.get('host_header', host)}\r\n"
+        "User-Agent: service-monitor\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    sock.sendall(request.encode())
+    
+    response = b""
+    while len(response) < HEALTH_PROBE_MAX_RESPONSE:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        response += chunk
+    
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        return False, f"Invalid HTTP response: {status_line!r}"
+    
+    status = int(parts[1])
+    expected = options.get("expect_status", 200)
+    expected = expected if isinstance(expected, (list, tuple)) else [expected]
+    if status not in expected:
+        return False, f"HTTP {path} returned {status}, expected {', '.join(str(code) for code in expected)}"
+    
+    expect_body = options.get("expect_body")
+    if expect_body and expect_body.encode() not in body:
+        return False, f"HTTP {path} body does not contain {expect_body!r}"
+    
+    return True, f"HTTP {path} returned {status}"
+
+def probe_redis(sock, host, options):
+    sock.sendall(b"*1\r\n$4\r\nPING\r\n")
+    reply = sock.recv(512).split(b"\r\n", 1)[0].decode("latin-1")
+    
+    # A NOAUTH error still proves the server is answering commands.
+    if reply == "+PONG" or reply.startswith("-NOAUTH"):
+        return True, f"Redis replied {reply}"
+    return False, f"Redis replied {reply or 'nothing'} to PING"
+
+def probe_mysql(sock, host, options):
+    header = recv_exactly(sock, 4)
+    length = int.from_bytes(header[:3], "little")
+    payload = recv_exactly(sock, length)
+    
+    if not payload:
+        return False, "Empty MySQL greeting packet"
+    if payload[0] == 0xFF:
+        message = payload[9:].decode("utf-8", "replace") if len(payload) > 9 else ""
+        return False, f"MySQL refused connection: {message}"
+    if payload[0] != 10:
+        return False, f"Unexpected MySQL protocol version {payload[0]}"
+    
+    version = payload[1:payload.index(b"\0", 1)].decode("latin-1")
+    return True, f"MySQL {version} greeting received"
+
+def probe_postgres(sock, host, options):
+    # SSLRequest: length 8 followed by the magic request code 80877103.
+    sock.sendall((8).to_bytes(4, "big") + (80877103).to_bytes(4, "big"))
+    reply = recv_exactly(sock, 1)
+    
+    if reply in (b"S", b"N"):
+        return True, "PostgreSQL answered SSLRequest"
+    return False, f"Unexpected PostgreSQL reply {reply!r} to SSLRequest"
+
+HEALTH_PROBES = {
+    "http": probe_http,
+    "redis": probe_redis,
+    "mysql": probe_mysql,
+    "postgres": probe_postgres,
+}
+
+def run_health_probe(config):
+    options = config["health_check"]
+    probe = HEALTH_PROBES.get(options.get("type"))
+    if probe is None:
+        return False, f"Unknown health check type {options.get('type')!r}"
+    
+    host = options.get("host", service_host(config))
+    port = options.get("port", config["port"])
+    timeout = options.get("timeout", 2)
+    
+    started = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            healthy, message = probe(sock, host, options)
+        latency = time.monotonic() - started
+        
+        if not healthy:
+            return False, message
+        
+        max_latency = options.get("max_latency")
+        if max_latency is not None and latency > max_latency:
+            return False, f"{message} in {latency * 1000:.0f}ms, above the {max_latency * 1000:.0f}ms threshold"
+        return True, f"{message} in {latency * 1000:.0f}ms"
+    except Exception as e:
+        # Garbage from the service or bad probe options must count as a failed
+        # check, not escape to the scheduler, which would not count it at all.
+        return False, f"{options['type']} health check failed: {type(e).__name__}: {str(e)}"
+
+RESOURCE_LIMIT_KEYS = {"cpu_percent", "memory_mb", "fds", "threads"}
+
+class ResourceSampler:
+    # Samples CPU, memory, fd and thread usage of a service's main process
+    # (and its cgroup when one is found). Files are opened once and re-read
+    # with pread, so a sample costs a few syscalls rather than open/close.
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.cgroups = {}
+        self.previous = {}
+        self.latest = {}
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+    
+    def _read(self, service_name, kind, path):
+        key = (service_name, kind)
+        with self.lock:
+            current = self.files.get(key)
+            if current is not None and current[0] != path:
+                os.close(current[1])  # The main PID changed since the last sample
+                current = None
+            if current is None:
+                current = (path, os.open(path, os.O_RDONLY))
+                self.files[key] = current
+        
+        try:
+            return os.pread(current[1], 65536, 0).decode()
+        except OSError:
+            with self.lock:
+                if self.files.get(key) == current:
+                    del self.files[key]
+                    os.close(current[1])
+            raise
+    
+    def _cgroup_dir(self, service_name, pid):
+        with self.lock:
+            cached = self.cgroups.get(service_name)
+        if cached is None or cached[0] != pid:
+            path = None
+            try:
+                with open(f"/proc/{pid}/cgroup") as f:
+                    for line in f:
+                        # Only a unit's own cgroup describes the service; a shared
+                        # parent such as the root would count everything else too.
+                        if line.startswith("0::") and line.strip().endswith(".service"):
+                            path = "/sys/fs/cgroup" + line[3:].strip()
+            except OSError:
+                pass
+            cached = (pid, path)
+            with self.lock:
+                self.cgroups[service_name] = cached  # Re-resolved only when the main PID changes
+        return cached[1]
+    
+    def sample(self, service_name, pid):
+        fields = self._read(service_name, "stat", f"/proc/{pid}/stat").rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        memory = int(fields[21]) * self.page_size
+        threads = int(fields[17])
+        
+        cgroup = self._cgroup_dir(service_name, pid)
+        if cgroup and os.path.exists(f"{cgroup}/memory.current"):
+            memory = int(self._read(service_name, "memory", f"{cgroup}/memory.current"))
+            for line in self._read(service_name, "cpu", f"{cgroup}/cpu.stat").splitlines():
+                if line.startswith("usage_usec "):
+                    cpu_seconds = int(line.split()[1]) / 1e6
+        
+        try:
+            fds = len(os.listdir(f"/proc/{pid}/fd"))
+        except OSError:
+            fds = None  # Other users' fd tables need root
+        
+        now = time.monotonic()
+        previous = self.previous.get(service_name)
+        cpu_percent = None
+        if previous and previous[0] == pid and now > previous[1]:
+            cpu_percent = max(0.0, (cpu_seconds - previous[2]) / (now - previous[1]) * 100)
+        self.previous[service_name] = (pid, now, cpu_seconds)
+        
+        usage = {"cpu_percent": cpu_percent, "memory_mb": memory / (1024 * 1024), "fds": fds, "threads": threads}
+        self.latest[service_name] = usage
+        return usage
+    
+    def forget(self, service_name):
+        with self.lock:
+            for key in [key for key in self.files if key[0] == service_name]:
+                os.close(self.files.pop(key)[1])
+            self.cgroups.pop(service_name, None)
+        self.previous.pop(service_name, None)
+        self.latest.pop(service_name, None)
+
+resource_sampler = ResourceSampler()
+
+def service_main_pid(config):
+    if config.get("pid_file"):
+        with open(config["pid_file"]) as f:
+            return int(f.read().strip() or 0)
+    
+    unit_state = status_collector.get_unit_state(config["service_name"])
+    pid = unit_state.get("MainPID", "0") if unit_state else "0"
+    return int(pid) if pid.isdigit() else 0
+
+def check_resource_limits(service_name, config):
+    try:
+        pid = service_main_pid(config)
+        if not pid:
+            return True, "No main process to sample"
+        usage = resource_sampler.sample(service_name, pid)
+    except (OSError, ValueError, RuntimeError) as e:
+        return True, f"Resource usage unavailable: {str(e)}"
+    
+    for key, limit in sorted(config["resource_limits"].items()):
+        value = usage.get(key)
+        if value is not None and value > limit:
+            return False, f"{key} {value:.1f} above limit {limit}"
+    return True, ""
+
+def observe_check_duration(service_name, phase, seconds):
+    # Each service is checked by one worker at a time, so its histograms have a single writer.
+    histogram = check_durations.get((service_name, phase))
+    if histogram is None:
+        histogram = check_durations.setdefault((service_name, phase), LatencyHistogram())
+    histogram.observe(seconds)
+
+def check_service_status(service_name):
+    if service_name not in SERVICES_CONFIG:
+        return False, "Service not configured"
+    
+    config = SERVICES_CONFIG[service_name]
+    
+    started = time.monotonic()
+    if config.get("status_backend") == "systemd":
+        returncode, stdout, stderr = check_unit_status(config)
+    else:
+        returncode, stdout, stderr = run_service_command(config, config["status_command"])
+    observe_check_duration(service_name, "status", time.monotonic() - started)
+    
+    if config["port"] is not None:
+        started = time.monotonic()
+        port_status = is_port_open(service_host(config), config["port"], config.get("port_timeout", 1))
+        observe_check_duration(service_name, "port", time.monotonic() - started)
+    else:
+        port_status = None
+    
+    if returncode == 0 and (port_status is None or port_status):
+        if config.get("resource_limits"):
+            started = time.monotonic()
+            within_limits, message = check_resource_limits(service_name, config)
+            observe_check_duration(service_name, "resources", time.monotonic() - started)
+            if not within_limits:
+                return False, f"Service is running but {message}"
+        
+        if config.get("health_check"):
+            started = time.monotonic()
+            with trace_phase("health"):
+                result = run_health_probe(config)
+            observe_check_duration(service_name, "health", time.monotonic() - started)
+            return result
+        return True, stdout
+    else:
+        if returncode != 0:
+            return False, stderr
+        else:
+            return False, f"Service is running but port {config['port']} is not open"
+
+NOTIFICATION_TITLES = {
+    "failure": "{count} services down",
+    "restart": "{count} services restarted",
+    "restart_failed": "{count} service restarts failed",
+    "manual_intervention": "{count} services need manual intervention",
+    "recovered": "{count} services recovered",
+}
+
+def send_webhook(channel, subject, body, events):
+    payload = json.dumps({
+        "subject": subject,
+        "text": body,
+        "events": [{"kind": kind, "service": service, "message": message, "time": at}
+                   for kind, service, message, at in events],
+    }).encode()
+    request = urllib.request.Request(channel["url"], data=payload, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=channel.get("timeout", 10)) as response:
+        response.read()
+
+def send_smtp(channel, subject, body, events):
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = channel["from"]
+    message["To"] = ", ".join(channel["to"])
+    message.set_content(body)
+    
+    with smtplib.SMTP(channel.get("host", "localhost"), channel.get("port", 25), timeout=channel.get("timeout", 10)) as server:
+        if channel.get("starttls"):
+            server.starttls()
+        if channel.get("username"):
+            server.login(channel["username"], channel["password"])
+        server.send_message(message)
+
+def send_syslog(channel, subject, body, events):
+    # RFC 3164 over UDP; facility daemon (3), severity warning (4).
+    hostname = socket.gethostname()
+    timestamp = time.strftime("%b %d %H:%M:%S")
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for line in [subject] + body.splitlines():
+            packet = f"<28>{timestamp} {hostname} service-monitor: {line}".encode()
+            sock.sendto(packet, (channel.get("host", "127.0.0.1"), channel.get("port", 514)))
+
+def send_file(channel, subject, body, events):
+    with open(channel["path"], "a") as f:
+        f.write(f"{subject}\n{body}\n\n")
+
+NOTIFICATION_SINKS = {
+    "webhook": (send_webhook, ("url",)),
+    "smtp": (send_smtp, ("from", "to")),
+    "syslog": (send_syslog, ()),
+    "file": (send_file, ("path",)),
+}
+
+class NotificationDispatcher:
+    # Notifications are queued by the check path and delivered by one worker:
+    # events arriving within NOTIFY_COALESCE_WINDOW go out as one message per
+    # kind, repeats of the same (kind, service) are suppressed for
+    # NOTIFY_DEDUP_WINDOW, and each channel has its own per-minute budget.
+    
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.channels = []
+        self.last_sent = {}
+        self.budgets = {}
+        self.thread = None
+        self.dropped = 0
+        self.suppressed = 0
+        self.rate_limited = 0
+        self.delivered = 0
+    
+    def configure(self, channels):
+        with self.lock:
+            self.channels = list(channels)
+            self.budgets = {}
+            if self.channels and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.run, name="notifications")
+                self.thread.daemon = True
+                self.thread.start()
+    
+    def notify(self, kind, service_name, message):
+        if not self.channels:
+            return
+        try:
+            self.queue.put_nowait((kind, service_name, message, time.time()))
+        except queue.Full:
+            self.dropped += 1
+    
+    def _collect(self):
+        events = [self.queue.get()]
+        deadline = time.monotonic() + NOTIFY_COALESCE_WINDOW
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return events
+            try:
+                events.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                return events
+    
+    def _deduplicate(self, events):
+        fresh = []
+        now = time.monotonic()
+        for event in events:
+            key = (event[0], event[1])
+            last = self.last_sent.get(key)
+            if last is not None and now - last < NOTIFY_DEDUP_WINDOW:
+                self.suppressed += 1
+                continue
+            self.last_sent[key] = now
+            fresh.append(event)
+        return fresh
+    
+    def _allow(self, index, channel):
+        # Token bucket refilled at the channel's per-minute rate.
+        rate = channel.get("rate_limit", NOTIFY_RATE_LIMIT)
+        now = time.monotonic()
+        tokens, updated = self.budgets.get(index, (rate, now))
+        tokens = min(rate, tokens + (now - updated) * rate / 60)
+        allowed = tokens >= 1
+        self.budgets[index] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+    
+    def _deliver(self, subject, body, events):
+        for index, channel in enumerate(self.channels):
+            if not self._allow(index, channel):
+                self.rate_limited += 1
+                continue
+            send, _ = NOTIFICATION_SINKS[channel["type"]]
+            try:
+                send(channel, subject, body, events)
+                self.delivered += 1
+            except Exception as e:
+                log_message(f"Cannot deliver notification via {channel['type']}: {str(e)}", "ERROR")
+    
+    def run(self):
+        while True:
+            events = self._deduplicate(self._collect())
+            
+            by_kind = {}
+            for event in events:
+                by_kind.setdefault(event[0], []).append(event)
+            
+            for kind, grouped in by_kind.items():
+                if len(grouped) == 1:
+                    subject = f"[service-monitor] {grouped[0][1]}: {grouped[0][2]}"
+                else:
+                    title = NOTIFICATION_TITLES.get(kind, "{count} " + kind + " events").format(count=len(grouped))
+                    subject = f"[service-monitor] {title} in {NOTIFY_COALESCE_WINDOW}s"
+                body = "\n".join(f"{format_timestamp(at)} {service}: {message}" for _, service, message, at in grouped)
+                self._deliver(subject, body, grouped)
+
+notifier = NotificationDispatcher()
+
+def validate_notification_channels(channels):
+    if not isinstance(channels, list):
+        raise ConfigError("notifications must be a list of channels")
+    
+    validated = []
+    for channel in channels:
+        if not isinstance(channel, dict) or channel.get("type") not in NOTIFICATION_SINKS:
+            raise ConfigError(f"notification type must be one of {', '.join(sorted(NOTIFICATION_SINKS))}")
+        missing = [key for key in NOTIFICATION_SINKS[channel["type"]][1] if not channel.get(key)]
+        if missing:
+            raise ConfigError(f"{channel['type']} notification channel needs {', '.join(missing)}")
+        rate = channel.get("rate_limit", NOTIFY_RATE_LIMIT)
+        if not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0:
+            raise ConfigError(f"{channel['type']} notification rate_limit must be a positive number")
+        
+        if channel["type"] == "smtp":
+            # A single recipient may be given as a plain string.
+            recipients = [channel["to"]] if isinstance(channel["to"], str) else channel["to"]
+            if not isinstance(recipients, list) or not all(isinstance(address, str) and address for address in recipients):
+                raise ConfigError("smtp notification channel 'to' must be an address or a list of addresses")
+            channel = dict(channel, to=recipients)
+        validated.append(channel)
+    return validated
+
+class StateDatabase:
+    # Keeps per-service counters and the restart history in SQLite (WAL mode)
+    # so restart budgets survive a restart of the monitor itself.
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS service_state (
+            name TEXT PRIMARY KEY,
+            restart_count INTEGER NOT NULL,
+            restart_attempts INTEGER NOT NULL,
+            failures INTEGER NOT NULL,
+            last_restart REAL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS restart_events (
+            id INTEGER PRIMARY KEY,
+            service TEXT NOT NULL,
+            at REAL NOT NULL,
+            success INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS restart_events_service_at ON restart_events (service, at);
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.path = None
+    
+    def _connect(self):
+        # Called with the lock held.
+        if self.connection is not None and self.path == state_db_file:
+            return self.connection
+        if self.connection is not None:
+            self.connection.close()
+        
+        self.path = state_db_file
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.execute("DELETE FROM restart_events WHERE at < ?",
+                                (time.time() - RESTART_HISTORY_DAYS * 86400,))
+        self.connection.commit()
+        return self.connection
+    
+    def _run(self, statement, parameters=(), fetch=False):
+        try:
+            with self.lock:
+                connection = self._connect()
+                with connection:
+                    cursor = connection.execute(statement, parameters)
+                    return cursor.fetchall() if fetch else None
+        except sqlite3.Error as e:
+            log_message(f"State database error: {str(e)}", "ERROR")
+            return [] if fetch else None
+    
+    def load_state(self, name):
+        rows = self._run("SELECT restart_count, restart_attempts, failures, last_restart "
+                         "FROM service_state WHERE name = ?", (name,), fetch=True)
+        return rows[0] if rows else None
+    
+    def save_state(self, state):
+        self._run("INSERT OR REPLACE INTO service_state VALUES (?, ?, ?, ?, ?, ?)",
+                  (state.name, state.restart_count, state.restart_attempts, state.failures,
+                   state.last_restart, time.time()))
+    
+    def record_restart(self, name, success):
+        self._run("INSERT INTO restart_events (service, at, success) VALUES (?, ?, ?)",
+                  (name, time.time(), int(success)))
+    
+    def restarts_per_hour(self, name, hours=24):
+        since = time.time() - hours * 3600
+        rows = self._run("SELECT CAST(at / 3600 AS INTEGER) AS hour, COUNT(*) FROM restart_events "
+                         "WHERE service = ? AND at >= ? GROUP BY hour ORDER BY hour",
+                         (name, since), fetch=True)
+        return [(hour * 3600, count) for hour, count in rows]
+    
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+state_db = StateDatabase()
+atexit.register(state_db.close)
+
+def restart_service(service_name):
+    if service_name not in SERVICES_CONFIG:
+        log_message(f"Cannot restart {service_name}: Service not configured", "ERROR")
+        return False
+    
+    config = SERVICES_CONFIG[service_name]
+    
+    log_message(f"Attempting to restart {service_name}...", "WARNING")
+    returncode, stdout, stderr = run_service_command(
+        config, config["restart_command"], config.get("restart_timeout", RESTART_COMMAND_TIMEOUT))
+    
+    state_db.record_restart(service_name, returncode == 0)
+    
+    if returncode == 0:
+        log_message(f"Successfully restarted {service_name}", "SUCCESS")
+        notifier.notify("restart", service_name, "restarted successfully")
+        return True
+    else:
+        log_message(f"Failed to restart {service_name}: {stderr}", "ERROR")
+        notifier.notify("restart_failed", service_name, f"restart failed: {stderr.strip()}")
+        return False
+
+class RestartCoordinator:
+    # Keeps a shared outage from turning into a restart storm: restarts are
+    # capped globally and per restart_group, and a service whose dependency
+    # is unhealthy waits for it instead of being restarted on its own.
+    
+    def __init__(self, limit=RESTART_CONCURRENCY, group_limit=RESTART_GROUP_CONCURRENCY):
+        self.limit = limit
+        self.group_limit = group_limit
+        self.lock = threading.Lock()
+        self.active = 0
+        self.groups = {}
+    
+    def try_acquire(self, group):
+        with self.lock:
+            if self.active >= self.limit:
+                return False
+            if group is not None and self.groups.get(group, 0) >= self.group_limit:
+                return False
+            self.active += 1
+            if group is not None:
+                self.groups[group] = self.groups.get(group, 0) + 1
+            return True
+    
+    def release(self, group):
+        with self.lock:
+            self.active -= 1
+            if group is not None:
+                self.groups[group] -= 1
+    
+    def unhealthy_dependency(self, config):
+        for dependency in config.get("depends_on", ()):
+            state = monitored_services.get(dependency)
+            if state is not None and state.status != "Running":
+                return dependency
+        return None
+    
+    def backoff(self, attempt):
+        # Equal jitter: at least half the exponential delay, so services that
+        # failed together do not all come back for their recheck at once.
+        delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** max(0, attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+restart_coordinator = RestartCoordinator()
+
+class ProcessExitWatcher:
+    # Watches the MainPID of event-driven services through pidfds so an exit
+    # triggers an immediate check instead of waiting for the next poll.
+    
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.watched = {}
+        self.thread = None
+    
+    def available(self):
+        return hasattr(os, "pidfd_open")
+    
+    def _start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.run, name="process-exit-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def _close(self, service_name):
+        # Called with the lock held.
+        entry = self.watched.pop(service_name, None)
+        if entry:
+            self.selector.unregister(entry[1])
+            os.close(entry[1])
+    
+    def watch(self, service_name, pid):
+        if not self.available() or not pid:
+            return False
+        
+        with self.lock:
+            current = self.watched.get(service_name)
+            if current and current[0] == pid:
+                return True
+            self._close(service_name)
+            
+            try:
+                fd = os.pidfd_open(pid)
+            except OSError as e:
+                log_message(f"Cannot watch main process {pid} of {service_name}: {str(e)}", "WARNING")
+                return False
+            
+            self.selector.register(fd, selectors.EVENT_READ, service_name)
+            self.watched[service_name] = (pid, fd)
+            self._start()
+        return True
+    
+    def unwatch(self, service_name):
+        with self.lock:
+            self._close(service_name)
+    
+    def run(self):
+        while not stop_event.is_set():
+            if not self.watched:
+                stop_event.wait(1)
+                continue
+            
+            for key, _ in self.selector.select(timeout=1):
+                exited_at = time.monotonic()
+                with self.lock:
+                    entry = self.watched.get(key.data)
+                    if not entry or entry[1] != key.fd:
+                        continue
+                    self._close(key.data)
+                on_process_exit(key.data, entry[0], exited_at)
+
+exit_watcher = ProcessExitWatcher()
+
+def on_process_exit(service_name, pid, exited_at):
+    state = monitored_services.get(service_name)
+    if state is None or scheduler.is_running(service_name):
+        return  # A check in progress reschedules the service itself
+    
+    state.event_exit_at = exited_at
+    log_message(f"Main process {pid} of {service_name} exited, checking immediately", "WARNING")
+    scheduler.schedule(service_name)
+
+def arm_exit_watch(service_name, config):
+    try:
+        unit_state = status_collector.get_unit_state(config["service_name"])
+    except Exception as e:
+        log_message(f"Cannot read main PID of {service_name}: {str(e)}", "WARNING")
+        return False
+    
+    pid = unit_state.get("MainPID", "0") if unit_state else "0"
+    return exit_watcher.watch(service_name, int(pid) if pid.isdigit() else 0)
+
+def record_detection_latency(service_name, state):
+    if state.event_exit_at is not None:
+        mode = "event"
+        latency = time.monotonic() - state.event_exit_at
+        state.event_exit_at = None
+    elif state.last_ok_at is not None:
+        # Without an exit event the crash time is unknown; this is an upper bound.
+        mode = "poll"
+        latency = time.monotonic() - state.last_ok_at
+    else:
+        return
+    
+    detection_latency[mode].append(latency)
+    log_message(f"Detected failure of {service_name} in {latency:.2f}s ({mode})", "INFO")
+
+def format_detection_latency():
+    parts = []
+    for mode in ("event", "poll"):
+        samples = detection_latency[mode]
+        if samples:
+            parts.append("{} avg {:.2f}s / max {:.2f}s over {}".format(
+                mode, sum(samples) / len(samples), max(samples), len(samples)))
+    return ", ".join(parts)
+
+class AdaptiveIntervalPolicy:
+    # Stretches the interval of services that stay healthy and snaps it back
+    # (or below) as soon as a check fails or its latency drifts from normal.
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checks_run = 0
+        self.fixed_equivalent = 0.0
+    
+    def next_interval(self, state, latency):
+        base = state.interval
+        baseline = state.latency_baseline
+        drifted = (baseline is not None and latency > baseline * ADAPTIVE_DRIFT_FACTOR and
+                   latency - baseline > ADAPTIVE_DRIFT_MIN)
+        state.latency_baseline = latency if baseline is None else baseline + (latency - baseline) * ADAPTIVE_SMOOTHING
+        
+        # A failure within the last ADAPTIVE_FAILURE_MEMORY intervals keeps a
+        # flaky service on a shorter-than-configured interval.
+        recently_failed = (state.last_failure_at is not None and
+                           time.monotonic() - state.last_failure_at < base * ADAPTIVE_FAILURE_MEMORY)
+        
+        if drifted:
+            state.healthy_streak = 0
+            delay = base / 2
+        elif recently_failed:
+            state.healthy_streak = 0
+            delay = base * ADAPTIVE_FAILURE_FACTOR
+        else:
+            state.healthy_streak += 1
+            growth = ADAPTIVE_GROWTH ** max(0, state.healthy_streak - ADAPTIVE_WARMUP)
+            delay = min(base * ADAPTIVE_MAX_FACTOR, base * growth)
+        
+        with self.lock:
+            self.checks_run += 1
+            # How many checks a fixed interval would have run in the same time
+            self.fixed_equivalent += delay / base
+        return delay
+    
+    def checks_saved(self):
+        return self.fixed_equivalent - self.checks_run
+
+adaptive_policy = AdaptiveIntervalPolicy()
+
+def monitor_service(service_name):
+    # Runs a single check and returns the delay until the next one, or None to stop.
+    service_config = SERVICES_CONFIG.get(service_name)
+    if not service_config:
+        log_message(f"Cannot monitor {service_name}: Service not configured", "ERROR")
+        return None
+    
+    state = monitored_services.get(service_name)
+    if state is None or state.cancelled.is_set():
+        return None
+    
+    interval = state.interval
+    max_failures = 3
+    max_restart_attempts = 5
+    event_driven = service_config.get("event_detection") and exit_watcher.available()
+    
+    started = time.monotonic()
+    is_running, status_msg = check_service_status(service_name)
+    state.check_latencies.append(time.monotonic() - started)
+    if state.cancelled.is_set():
+        return None  # Monitoring was stopped while the check was running
+    
+    if is_running:
+        recovered = state.failures or state.restart_attempts
+        was_down = state.failures >= max_failures or state.restart_attempts
+        state.failures = 0
+        state.restart_attempts = 0
+        state.status = "Running"
+        state.last_check = time.time()
+        state.last_ok_at = time.monotonic()
+        state.event_exit_at = None
+        if recovered:
+            state_db.save_state(state)
+        if was_down:
+            notifier.notify("recovered", service_name, "is running again")
+        
+        if service_config.get("adaptive"):
+            interval = adaptive_policy.next_interval(state, state.check_latencies[-1])
+        if event_driven and arm_exit_watch(service_name, service_config):
+            return interval * EVENT_POLL_MULTIPLIER  # Polling is only a safety net now
+        return interval
+    
+    state.failures += 1
+    state.healthy_streak = 0
+    state.last_failure_at = time.monotonic()
+    failures = state.failures
+    state.status = "Failed"
+    state.last_check = time.time()
+    
+    if failures == 1:
+        record_detection_latency(service_name, state)
+    
+    if failures == max_failures:
+        notifier.notify("failure", service_name, f"down: {status_msg.strip() or 'status check failed'}")
+    
+    if failures >= max_failures:
+        if state.restart_attempts >= max_restart_attempts:
+            log_message(f"Service {service_name} has failed {failures} times and reached maximum restart attempts ({max_restart_attempts})", "ERROR")
+            log_message(f"Manual intervention required for {service_name}", "ERROR")
+            state.status = "Failed - Manual intervention required"
+            state_db.save_state(state)
+            notifier.notify("manual_intervention", service_name, f"still failing after {max_restart_attempts} restart attempts")
+            stop_monitoring_service(service_name)
+            return None
+        
+        dependency = restart_coordinator.unhealthy_dependency(service_config)
+        if dependency is not None:
+            state.status = f"Waiting for {dependency}"
+            if failures == max_failures:
+                log_message(f"Delaying restart of {service_name} until {dependency} is healthy", "WARNING")
+            return min(interval / 2, RESTART_RETRY_DELAY)
+        
+        group = service_config.get("restart_group")
+        if not restart_coordinator.try_acquire(group):
+            state.status = "Restart queued"
+            return min(interval / 2, RESTART_RETRY_DELAY)
+        
+        try:
+            state.restart_attempts += 1
+            # The restart kills the watched MainPID; that exit must not trigger another check.
+            exit_watcher.unwatch(service_name)
+            successfully_restarted = restart_service(service_name)
+        finally:
+            restart_coordinator.release(group)
+        
+        if successfully_restarted:
+            state.failures = 0
+            state.status = "Restarted"
+            state.last_restart = time.time()
+            state.restart_count += 1
+        
+        state_db.save_state(state)
+        # Give the service time to start up, backing off further on every attempt
+        return restart_coordinator.backoff(state.restart_attempts)
+    
+    state_db.save_state(state)
+    log_message(f"Service {service_name} appears to be down (failure {failures}/{max_failures})", "WARNING")
+    if event_driven:
+        return min(interval / 2, EVENT_RECHECK_DELAY)
+    return interval / 2  # Check more frequently during potential failure
+
+class MonitorScheduler:
+    # Drives every monitored service from one thread using a deadline heap.
+    # Checks run on a worker pool that keeps CHECK_WORKERS threads and grows
+    # whenever every worker is busy, so checks stuck on a slow status command
+    # never hold up the checks of other services.
+    
+    def __init__(self, workers=CHECK_WORKERS):
+        self.workers = workers
+        self.queue = []
+        self.entries = {}
+        self.running = set()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.ready = queue.Queue()
+        self.threads = 0
+        self.idle = 0
+        self.pending = 0
+        self.thread = None
+        self.lag = LatencyHistogram()
+        self.tokens = MAX_CHECKS_PER_SECOND
+        self.token_time = time.monotonic()
+        self.reserved = set()
+    
+    def start(self):
+        with self.condition:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name="monitor-scheduler")
+            self.thread.daemon = True
+            self.thread.start()
+    
+    def stop(self):
+        stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+            for _ in range(self.threads):
+                self.ready.put(None)
+    
+    def schedule(self, service_name, delay=0):
+        with self.condition:
+            seq = next(self.counter)
+            self.entries[service_name] = seq
+            heapq.heappush(self.queue, (time.monotonic() + delay, seq, service_name))
+            self.condition.notify()
+    
+    def cancel(self, service_name):
+        with self.condition:
+            found = self.entries.pop(service_name, None) is not None
+            self.condition.notify()
+        return found
+    
+    def is_scheduled(self, service_name):
+        with self.condition:
+            return service_name in self.entries
+    
+    def is_running(self, service_name):
+        with self.condition:
+            return service_name in self.running
+    
+    def _next_due(self):
+        # Called with the condition held. Blocks until an entry is due or stop is requested.
+        while not stop_event.is_set():
+            while self.queue and self.entries.get(self.queue[0][2]) != self.queue[0][1]:
+                self.reserved.discard(heapq.heappop(self.queue)[1])  # Cancelled or superseded entry
+            
+            if not self.queue:
+                self.condition.wait()
+                continue
+            
+            delay = self.queue[0][0] - time.monotonic()
+            if delay > 0:
+                self.condition.wait(delay)
+                continue
+            
+            entry = heapq.heappop(self.queue)
+            if entry[1] in self.reserved:
+                self.reserved.discard(entry[1])
+                return entry
+            wait = self._take_token() if self._rate_limited(entry[2]) else 0
+            if wait <= 0:
+                return entry
+            # Only this check waits for its token; failure rechecks behind it go ahead.
+            self.reserved.add(entry[1])
+            heapq.heappush(self.queue, (time.monotonic() + wait, entry[1], entry[2]))
+        return None
+    
+    def _rate_limited(self, service_name):
+        # The cap only spreads out routine checks of healthy adaptive services,
+        # never failure rechecks or checks triggered by a process exit.
+        config = SERVICES_CONFIG.get(service_name)
+        state = monitored_services.get(service_name)
+        return (config is not None and bool(config.get("adaptive")) and state is not None and
+                state.status == "Running" and state.event_exit_at is None)
+    
+    def _take_token(self):
+        # Token bucket capping routine checks per second across the fleet. The
+        # token is always taken; the result is how long until it is actually
+        # available, so deferred checks get successive slots.
+        if not MAX_CHECKS_PER_SECOND:
+            return 0
+        
+        now = time.monotonic()
+        self.tokens = min(MAX_CHECKS_PER_SECOND, self.tokens + (now - self.token_time) * MAX_CHECKS_PER_SECOND)
+        self.token_time = now
+        self.tokens -= 1
+        return max(0, -self.tokens / MAX_CHECKS_PER_SECOND)
+    
+    def run(self):
+        while not stop_event.is_set():
+            with self.condition:
+                entry = self._next_due()
+                if entry is None:
+                    break
+                self.running.add(entry[2])
+                self._dispatch(entry)
+    
+    def _dispatch(self, entry):
+        # Called with the condition held.
+        if self.pending >= self.idle and self.threads < CHECK_WORKERS_MAX:
+            self.threads += 1
+            self.idle += 1
+            thread = threading.Thread(target=self._worker, name="monitor-check")
+            thread.daemon = True
+            thread.start()
+        self.pending += 1
+        self.ready.put(entry)
+    
+    def _worker(self):
+        while True:
+            try:
+                entry = self.ready.get(timeout=CHECK_WORKER_IDLE)
+            except queue.Empty:
+                with self.condition:
+                    # Threads beyond the base pool exit once the backlog is gone.
+                    if self.pending or self.threads <= self.workers:
+                        continue
+                    self.threads -= 1
+                    self.idle -= 1
+                    return
+            if entry is None:
+                return  # stop()
+            
+            with self.condition:
+                self.pending -= 1
+                self.idle -= 1
+            deadline, seq, service_name = entry
+            self._run_check(service_name, seq, deadline)
+            with self.condition:
+                self.idle += 1
+    
+    def _run_check(self, service_name, seq, deadline):
+        lateness = max(0, time.monotonic() - deadline)
+        with self.condition:
+            self.lag.observe(lateness)
+        begin_check_trace()
+        try:
+            delay = monitor_service(service_name)
+        except Exception as e:
+            log_message(f"Error while checking {service_name}: {str(e)}", "ERROR")
+            state = monitored_services.get(service_name)
+            delay = state.interval if state else None
+        finally:
+            end_check_trace(service_name, lateness)
+        
+        with self.condition:
+            self.running.discard(service_name)
+            if self.entries.get(service_name) != seq:
+                return  # Stopped or restarted while the check was running
+            if delay is None or stop_event.is_set():
+                self.entries.pop(service_name, None)
+                return
+        
+        self.schedule(service_name, delay)
+
+scheduler = MonitorScheduler()
+
+def format_slowest_checks(limit=20):
+    traces = [trace for history in list(check_traces.values()) for trace in list(history)]
+    lines = [f"Slowest {min(limit, len(traces))} of {len(traces)} traced checks:"]
+    for trace in sorted(traces, key=lambda trace: trace.total, reverse=True)[:limit]:
+        breakdown = ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in
+                              sorted(trace.phases.items(), key=lambda item: item[1], reverse=True))
+        lines.append(f"{format_timestamp(trace.at)} {trace.service}: {trace.total * 1000:.1f}ms "
+                     f"(late {trace.lateness * 1000:.1f}ms; {breakdown})")
+    
+    lines.append("")
+    lines.append("Average phase times per service:")
+    for service_name, history in sorted(check_traces.items()):
+        history = list(history)
+        if not history:
+            continue
+        totals = {}
+        for trace in history:
+            for phase, seconds in trace.phases.items():
+                totals[phase] = totals.get(phase, 0) + seconds
+        breakdown = ", ".join(f"{phase} {seconds / len(history) * 1000:.1f}ms" for phase, seconds in sorted(totals.items()))
+        lateness = sum(trace.lateness for trace in history) / len(history)
+        lines.append(f"{service_name}: {len(history)} checks, late {lateness * 1000:.1f}ms, {breakdown}")
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    # Periodically samples the stacks of all monitor threads. Toggled with
+    # SIGUSR1; the report is written when sampling stops.
+    
+    def __init__(self):
+        self.thread = None
+        self.active = threading.Event()
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+    
+    def toggle(self):
+        if self.active.is_set():
+            self.stop()
+        else:
+            self.start()
+    
+    def start(self):
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+        self.active.set()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler")
+        self.thread.daemon = True
+        self.thread.start()
+        log_message("Sampling profiler started", "INFO")
+    
+    def stop(self):
+        self.active.clear()
+        if self.thread is not None:
+            self.thread.join()
+        path = log_file + ".profile"
+        with open(path, "w") as f:
+            f.write(self.report())
+        log_message(f"Sampling profiler stopped, report written to {path}", "INFO")
+    
+    def run(self):
+        own_id = threading.get_ident()
+        while self.active.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                
+                location = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+                self.self_counts[location] = self.self_counts.get(location, 0) + 1
+                
+                seen = set()
+                while frame is not None:
+                    function = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})"
+                    if function not in seen:
+                        seen.add(function)
+                        self.total_counts[function] = self.total_counts.get(function, 0) + 1
+                    frame = frame.f_back
+            self.samples += 1
+            time.sleep(PROFILE_INTERVAL)
+    
+    def report(self, limit=30):
+        lines = [f"{self.samples} samples every {PROFILE_INTERVAL * 1000:g}ms across all threads", "", "Self time:"]
+        for location, count in sorted(self.self_counts.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"{count:8d}  {location}")
+        lines += ["", "Total time (including callees):"]
+        for function, count in sorted(self.total_counts.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"{count:8d}  {function}")
+        return "\n".join(lines) + "\n"
+
+profiler = SamplingProfiler()
+
+def dump_slowest_checks():
+    path = log_file + ".checks"
+    with open(path, "w") as f:
+        f.write(format_slowest_checks())
+    log_message(f"Check timing report written to {path}", "INFO")
+
+def run_debug_requests(requests):
+    while True:
+        try:
+            requests.get()()
+        except Exception as e:
+            log_message(f"Debug request failed: {str(e)}", "ERROR")
+
+def register_debug_signals():
+    # SIGUSR1 toggles the sampling profiler, SIGUSR2 dumps the slowest checks.
+    # The handlers only queue the work: joining threads, writing files or
+    # taking the log lock inside a handler could deadlock the interrupted thread.
+    requests = queue.Queue()
+    thread = threading.Thread(target=run_debug_requests, args=(requests,), name="debug-requests")
+    thread.daemon = True
+    thread.start()
+    
+    signal.signal(signal.SIGUSR1, lambda sig, frame: requests.put_nowait(profiler.toggle))
+    signal.signal(signal.SIGUSR2, lambda sig, frame: requests.put_nowait(dump_slowest_checks))
+
+def start_monitoring_service(service_name, interval=30):
+    if scheduler.is_scheduled(service_name):
+        log_message(f"Service {service_name} is already being monitored", "WARNING")
+        return False
+    
+    is_running, status_msg = check_service_status(service_name)
+    initial_status = "Running" if is_running else "Not running"
+    
+    state = ServiceState(service_name, initial_status, interval)
+    saved = state_db.load_state(service_name)
+    if saved:
+        state.restart_count, state.restart_attempts, state.failures, state.last_restart = saved
+    monitored_services.add(state)
+    
+    scheduler.start()
+    scheduler.schedule(service_name)
+    
+    log_message(f"Started monitoring service {service_name} at {interval} second intervals", "SUCCESS")
+    return True
+
+def stop_monitoring_service(service_name):
+    if service_name not in monitored_services:
+        log_message(f"Service {service_name} is not currently being monitored", "WARNING")
+        return False
+    
+    exit_watcher.unwatch(service_name)
+    resource_sampler.forget(service_name)
+    
+    if scheduler.cancel(service_name):
+        state = monitored_services.remove(service_name)
+        if state is not None:
+            state.status = "Monitoring stopped"
+        log_message(f"Stopped monitoring service {service_name}", "INFO")
+        return True
+    else:
+        monitored_services.remove(service_name)
+        
+        log_message(f"Monitoring for {service_name} was not active", "WARNING")
+        return False
+
+AGENT_FIELDS = ("status", "failures", "restart_count", "last_restart")
+
+def encode_frame(frame):
+    return json.dumps(frame, separators=(",", ":")).encode() + b"\n"
+
+def parse_socket_address(address):
+    # "unix:/path/to/socket" or "host:port"
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(":")
+    return None, (host.strip("[]") or "0.0.0.0", int(port))
+
+def connect_address(address, timeout):
+    family, target = parse_socket_address(address)
+    if family == socket.AF_UNIX:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(target)
+        return sock
+    return socket.create_connection(target, timeout=timeout)
+
+class AgentPublisher:
+    # Streams state changes of the local monitor to an aggregator. Only
+    # fields that changed since the last batch are sent; unacknowledged
+    # batches are kept so a reconnect resumes from the aggregator's last
+    # sequence number instead of resending everything.
+    
+    def __init__(self, address, agent_id, snapshot_source=None, stop=None):
+        self.address = address
+        self.agent_id = agent_id
+        self.snapshot_source = snapshot_source or monitored_services.snapshot
+        self.stop = stop or stop_event
+        self.session = os.urandom(8).hex()
+        self.published = {}
+        self.seq = 0
+        self.pending = deque(maxlen=AGENT_RESEND_BUFFER)
+        self.needs_reset = False
+        self.buffer = b""
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"agent-{self.agent_id}")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def collect_delta(self):
+        events = []
+        current = {}
+        for data in self.snapshot_source():
+            fields = {name: getattr(data, name) for name in AGENT_FIELDS}
+            current[data.name] = fields
+            previous = self.published.get(data.name, {})
+            changed = {name: value for name, value in fields.items() if previous.get(name) != value or name not in previous}
+            if changed:
+                events.append([data.name, changed])
+        
+        for name in self.published:
+            if name not in current:
+                events.append([name, None])
+        
+        self.published = current
+        return events
+    
+    def _send(self, sock, frame):
+        payload = encode_frame(frame)
+        sock.sendall(payload)
+        self.bytes_sent += len(payload)
+        self.frames_sent += 1
+    
+    def _read_frames(self, sock, timeout):
+        sock.settimeout(timeout)
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            return []
+        if not data:
+            raise ConnectionError("Aggregator closed the connection")
+        
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [json.loads(line) for line in lines if line]
+    
+    def _acknowledge(self, seq):
+        while self.pending and self.pending[0]["seq"] <= seq:
+            self.pending.popleft()
+    
+    def _publish(self, sock, events):
+        self.seq += 1
+        frame = {"t": "batch", "seq": self.seq, "events": events}
+        if self.needs_reset:
+            frame["reset"] = True
+            self.needs_reset = False
+        self.pending.append(frame)
+        self._send(sock, frame)
+    
+    def _session(self, sock):
+        self.buffer = b""
+        self._send(sock, {"t": "hello", "agent": self.agent_id, "session": self.session})
+        
+        acked = None
+        deadline = time.monotonic() + AGENT_CONNECT_TIMEOUT
+        while acked is None:
+            if time.monotonic() > deadline:
+                raise ConnectionError("No handshake reply from aggregator")
+            for frame in self._read_frames(sock, AGENT_CONNECT_TIMEOUT):
+                if frame.get("t") == "ack":
+                    acked = frame["seq"]
+        
+        self._acknowledge(acked)
+        if acked < self.seq and (not self.pending or self.pending[0]["seq"] > acked + 1):
+            # The batches the aggregator is missing were already dropped from the
+            # resend buffer, so start over with a full state.
+            self.pending.clear()
+            self.published = {}
+            self.needs_reset = True
+        else:
+            for frame in list(self.pending):
+                self._send(sock, frame)
+        
+        last_sent = time.monotonic()
+        while not self.stop.is_set():
+            events = self.collect_delta()
+            if events or self.needs_reset or time.monotonic() - last_sent >= AGENT_HEARTBEAT_INTERVAL:
+                self._publish(sock, events)
+                last_sent = time.monotonic()
+            
+            for frame in self._read_frames(sock, AGENT_BATCH_INTERVAL):
+                if frame.get("t") == "ack":
+                    self._acknowledge(frame["seq"])
+    
+    def run(self):
+        delay = 1
+        while not self.stop.is_set():
+            try:
+                sock = connect_address(self.address, AGENT_CONNECT_TIMEOUT)
+            except OSError as e:
+                log_message(f"Cannot reach aggregator {self.address}: {str(e)}", "WARNING")
+                self.stop.wait(delay)
+                delay = min(delay * 2, AGENT_RECONNECT_MAX)
+                continue
+            
+            delay = 1
+            try:
+                self._session(sock)
+            except (OSError, ValueError) as e:
+                log_message(f"Connection to aggregator {self.address} lost: {str(e)}", "WARNING")
+            finally:
+                sock.close()
+
+class Aggregator:
+    # Merges state-change streams from many agents on a single selector
+    # thread; each agent's view is kept as service name -> latest fields.
+    
+    def __init__(self, stop=None):
+        self.stop = stop or stop_event
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.agents = {}
+        self.listener = None
+        self.address = None
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.busy_time = 0.0
+        self.thread = None
+    
+    def start(self, address):
+        family, target = parse_socket_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.remove(target)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            family, _, _, _, target = socket.getaddrinfo(target[0], target[1], 0, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0]
+            self.listener = socket.socket(family, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        self.listener.bind(target)
+        self.listener.listen(AGGREGATOR_BACKLOG)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        
+        self.thread = threading.Thread(target=self.run, name="aggregator")
+        self.thread.daemon = True
+        self.thread.start()
+        log_message(f"Aggregating agent state on {address}", "INFO")
+    
+    def _close(self, sock, connection):
+        self.selector.unregister(sock)
+        sock.close()
+        if connection["agent"] is not None:
+            with self.lock:
+                self.agents[connection["agent"]]["connected"] = False
+    
+    def _handle(self, connection, frame):
+        kind = frame.get("t")
+        if kind == "hello":
+            agent_id = frame["agent"]
+            connection["agent"] = agent_id
+            with self.lock:
+                agent = self.agents.get(agent_id)
+                if agent is None or agent["session"] != frame["session"]:
+                    # New agent or restarted agent process: its sequence starts over.
+                    agent = {"session": frame["session"], "seq": 0, "services": {}}
+                    self.agents[agent_id] = agent
+                agent["connected"] = True
+                agent["last_seen"] = time.time()
+                return agent["seq"]
+        
+        if kind == "batch" and connection["agent"] is not None:
+            with self.lock:
+                agent = self.agents[connection["agent"]]
+                agent["last_seen"] = time.time()
+                if frame["seq"] <= agent["seq"]:
+                    return agent["seq"]  # Already applied before a reconnect
+                
+                if frame.get("reset"):
+                    agent["services"] = {}
+                for name, fields in frame["events"]:
+                    if fields is None:
+                        agent["services"].pop(name, None)
+                    else:
+                        agent["services"].setdefault(name, {}).update(fields)
+                agent["seq"] = frame["seq"]
+                return agent["seq"]
+        return None
+    
+    def _read(self, sock, connection):
+        try:
+            data = sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(sock, connection)
+            return
+        
+        self.bytes_received += len(data)
+        connection["buffer"] += data
+        *lines, connection["buffer"] = connection["buffer"].split(b"\n")
+        
+        ack = None
+        for line in lines:
+            if not line:
+                continue
+            try:
+                result = self._handle(connection, json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                log_message(f"Dropping agent connection after bad frame: {str(e)}", "WARNING")
+                self._close(sock, connection)
+                return
+            self.frames_received += 1
+            if result is not None:
+                ack = result
+        
+        # One acknowledgement per read covers every batch it contained.
+        if ack is not None:
+            try:
+                sock.send(encode_frame({"t": "ack", "seq": ack}))
+            except (BlockingIOError, InterruptedError):
+                pass  # The next acknowledgement supersedes this one
+            except OSError:
+                self._close(sock, connection)
+    
+    def run(self):
+        while not self.stop.is_set():
+            events = self.selector.select(timeout=1)
+            started = time.perf_counter()
+            for key, _ in events:
+                if key.fileobj is self.listener:
+                    try:
+                        sock, _ = self.listener.accept()
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    sock.setblocking(False)
+                    self.selector.register(sock, selectors.EVENT_READ, {"buffer": b"", "agent": None})
+                else:
+                    self._read(key.fileobj, key.data)
+            self.busy_time += time.perf_counter() - started
+        
+        self.selector.close()
+        self.listener.close()
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                agent_id: {
+                    "connected": agent.get("connected", False),
+                    "last_seen": agent.get("last_seen"),
+                    "services": {name: dict(fields) for name, fields in agent["services"].items()},
+                }
+                for agent_id, agent in self.agents.items()
+            }
+
+aggregator = Aggregator()
 
-def log_message(message, level="INFO"):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"{timestamp} [{level}] {message}"
-    
-    with open(log_file, "a") as f:
-        f.write(log_entry + "\n")
-    
-    if level == "ERROR":
-        print(colored(log_entry, 'red'))
-    elif level == "WARNING":
-        print(colored(log_entry, 'yellow'))
-    elif level == "SUCCESS":
-        print(colored(log_entry, 'green'))
-    else:
-        print(colored(log_entry, 'white'))
+def run_agent_load_test(agent_count, services_per_agent=20, duration=10, flips_per_second=1):
+    # Loopback load test: many synthetic agents flapping random services
+    # against one aggregator, reporting bandwidth and aggregator CPU.
+    stop = threading.Event()
+    test_aggregator = Aggregator(stop=stop)
+    test_aggregator.start("127.0.0.1:0")
+    address = "{}:{}".format(*test_aggregator.address[:2])
+    
+    truth = []
+    publishers = []
+    for index in range(agent_count):
+        services = {
+            f"svc{number}": ServiceSnapshot(f"svc{number}", "Running", None, None, 0, 0, 30, ())
+            for number in range(services_per_agent)
+        }
+        truth.append(services)
+        publisher = AgentPublisher(address, f"agent{index}", snapshot_source=lambda services=services: list(services.values()), stop=stop)
+        publishers.append(publisher)
+        publisher.start()
+    
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        for services in truth:
+            for _ in range(flips_per_second):
+                name = random.choice(list(services))
+                failed = services[name].status == "Running"
+                services[name] = services[name]._replace(
+                    status="Failed" if failed else "Running",
+                    failures=services[name].failures + 1 if failed else 0)
+        time.sleep(1)
+    
+    time.sleep(AGENT_BATCH_INTERVAL * 2)
+    stop.set()
+    elapsed = time.monotonic() - started
+    
+    merged = test_aggregator.snapshot()
+    mismatches = sum(
+        1
+        for index, services in enumerate(truth)
+        for name, data in services.items()
+        if merged.get(f"agent{index}", {}).get("services", {}).get(name, {}).get("status") != data.status
+    )
+    bytes_sent = sum(publisher.bytes_sent for publisher in publishers)
+    frames = test_aggregator.frames_received
+    
+    print(colored("AGENT LOAD TEST", 'green'))
+    print(colored("-" * 70, 'white'))
+    print(colored(f"Agents: {agent_count}, services per agent: {services_per_agent}, duration: {elapsed:.1f}s", 'white'))
+    print(colored(f"Frames received: {frames} ({frames / elapsed:.0f}/s)", 'white'))
+    print(colored(f"Bytes sent: {bytes_sent} ({bytes_sent / elapsed / agent_count:.0f} B/s per agent)", 'white'))
+    print(colored(f"Aggregator busy: {test_aggregator.busy_time:.3f}s ({test_aggregator.busy_time / max(frames, 1) * 1e6:.1f}us per frame)", 'white'))
+    print(colored(f"Services out of sync after drain: {mismatches}", 'green' if not mismatches else 'red'))
+    return mismatches == 0
 
-def execute_command(command):
-    try:
-        result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return result.returncode, result.stdout, result.stderr
-    except Exception as e:
-        return 1, "", str(e)
+class BenchmarkService:
+    # A synthetic service: a marker file its status command tests and a
+    # local listener its port probe connects to. Both can be broken on demand.
+    
+    def __init__(self, directory, index):
+        self.name = f"bench-{index}"
+        self.marker = os.path.join(directory, f"{self.name}.up")
+        self.hang_marker = os.path.join(directory, f"{self.name}.hang")
+        self.restarted_marker = os.path.join(directory, f"{self.name}.restarted")
+        self.listener = None
+        self.jammers = []
+        self.port = None
+        self.broken_at = None
+        self._listen()
+        open(self.marker, "w").close()
+    
+    def _listen(self, backlog=128):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", self.port or 0))
+        self.listener.listen(backlog)
+        self.port = self.listener.getsockname()[1]
+    
+    def config(self):
+        return {
+            "service_name": self.name,
+            "port": self.port,
+            "port_timeout": 0.5,
+            "status_command": "if [ -e {hang} ]; then sleep 5; fi; test -e {up}".format(
+                hang=shlex.quote(self.hang_marker), up=shlex.quote(self.marker)),
+            "restart_command": "rm -f {hang}; touch {up} {restarted}".format(
+                hang=shlex.quote(self.hang_marker), up=shlex.quote(self.marker),
+                restarted=shlex.quote(self.restarted_marker)),
+        }
+    
+    def break_service(self, mode):
+        self.broken_at = time.time()
+        if mode == "status":
+            os.remove(self.marker)
+        elif mode == "hang":
+            open(self.hang_marker, "w").close()
+        elif mode == "port":
+            self.listener.close()
+        elif mode == "port-hang":
+            # A zero backlog that is already full makes new connects hang.
+            self.listener.close()
+            self._listen(backlog=0)
+            for _ in range(2):
+                jammer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                jammer.setblocking(False)
+                jammer.connect_ex(("127.0.0.1", self.port))
+                self.jammers.append(jammer)
+    
+    def repair_if_restarted(self):
+        if not os.path.exists(self.restarted_marker):
+            return False
+        os.remove(self.restarted_marker)
+        for jammer in self.jammers:
+            jammer.close()
+        self.jammers = []
+        self.listener.close()
+        self._listen()
+        return True
+    
+    def close(self):
+        for jammer in self.jammers:
+            jammer.close()
+        self.listener.close()
 
-def is_port_open(host, port):
-    if port is None:
+def percentile(values, fraction):
+    if not values:
         return None
-    
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(1)
-    result = sock.connect_ex((host, port))
-    sock.close()
-    return result == 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
 
-def check_service_status(service_name):
-    if service_name not in SERVICES_CONFIG:
-        return False, "Service not configured"
+def process_rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def run_benchmark(service_count, duration=30, interval=5, faults_per_second=1,
+                  fault_modes=("status", "hang", "port", "port-hang")):
+    global log_file, state_db_file
     
-    config = SERVICES_CONFIG[service_name]
+    directory = tempfile.mkdtemp(prefix="service-monitor-bench-")
+    saved_paths = (log_file, state_db_file)
+    log_file = os.path.join(directory, "bench.log")
+    state_db_file = os.path.join(directory, "bench.db")
     
-    returncode, stdout, stderr = execute_command(config["status_command"])
+    rss_before = process_rss()
+    services = [BenchmarkService(directory, index) for index in range(service_count)]
+    for service in services:
+        SERVICES_CONFIG[service.name] = service.config()
     
-    if config["port"] is not None:
-        port_status = is_port_open("127.0.0.1", config["port"])
-    else:
-        port_status = None
+    usage_before = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    dispatched_before = scheduler.lag.count
+    lag_before = list(scheduler.lag.counts)
+    started = time.monotonic()
     
-    if returncode == 0 and (port_status is None or port_status):
-        return True, stdout
-    else:
-        if returncode != 0:
-            return False, stderr
-        else:
-            return False, f"Service is running but port {config['port']} is not open"
+    for service in services:
+        start_monitoring_service(service.name, interval)
+    
+    detection_to_restart = []
+    next_fault = time.monotonic()
+    while time.monotonic() - started < duration:
+        if time.monotonic() >= next_fault:
+            healthy = [service for service in services if service.broken_at is None]
+            for service in random.sample(healthy, min(faults_per_second, len(healthy))):
+                service.break_service(random.choice(fault_modes))
+            next_fault += 1
+        
+        for service in services:
+            if service.broken_at is not None and service.repair_if_restarted():
+                detection_to_restart.append(time.time() - service.broken_at)
+                service.broken_at = None
+        time.sleep(0.05)
+    
+    elapsed = time.monotonic() - started
+    usage_after = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    rss_after = process_rss()
+    checks = scheduler.lag.count - dispatched_before
+    
+    for service in services:
+        stop_monitoring_service(service.name)
+        SERVICES_CONFIG.pop(service.name, None)
+        service.close()
+    log_writer.close()
+    state_db.close()
+    log_file, state_db_file = saved_paths
+    shutil.rmtree(directory, ignore_errors=True)
+    
+    cpu_seconds = sum(
+        (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        for before, after in zip(usage_before, usage_after)
+    )
+    lag = LatencyHistogram()
+    lag.counts = [after - before for before, after in zip(lag_before, scheduler.lag.counts)]
+    lag.count = sum(lag.counts)
+    
+    def seconds(value):
+        return "n/a" if value is None else f"{value:.3f}s"
+    
+    report = {
+        "services": service_count,
+        "duration": elapsed,
+        "checks_per_second": checks / elapsed,
+        "cpu_percent_per_service": cpu_seconds / elapsed * 100 / service_count,
+        "rss_per_service": (rss_after - rss_before) / service_count,
+        "detection_to_restart": {
+            "count": len(detection_to_restart),
+            "p50": percentile(detection_to_restart, 0.5),
+            "p95": percentile(detection_to_restart, 0.95),
+            "p99": percentile(detection_to_restart, 0.99),
+        },
+        "scheduler_lag": {"p50": lag.percentile(0.5), "p99": lag.percentile(0.99)},
+    }
+    
+    print(colored("MONITOR BENCHMARK", 'green'))
+    print(colored("-" * 70, 'white'))
+    print(colored(f"Services: {service_count}, interval: {interval}s, duration: {elapsed:.1f}s", 'white'))
+    print(colored(f"Checks per second: {report['checks_per_second']:.1f}", 'white'))
+    print(colored(f"CPU per service (incl. child processes): {report['cpu_percent_per_service']:.3f}%", 'white'))
+    print(colored(f"RSS growth per service: {report['rss_per_service'] / 1024:.1f} KiB", 'white'))
+    print(colored("Detection to restart over {} faults: p50 {} / p95 {} / p99 {}".format(
+        len(detection_to_restart), *(seconds(report["detection_to_restart"][key]) for key in ("p50", "p95", "p99"))), 'white'))
+    print(colored("Scheduler lag: p50 <= {} / p99 <= {}".format(
+        seconds(report["scheduler_lag"]["p50"]), seconds(report["scheduler_lag"]["p99"])), 'white'))
+    return report
 
-def restart_service(service_name):
-    if service_name not in SERVICES_CONFIG:
-        log_message(f"Cannot restart {service_name}: Service not configured", "ERROR")
-        return False
+class StubServer:
+    # A loopback TCP server answering every connection with a canned
+    # exchange, standing in for a real service during --self-test.
     
-    config = SERVICES_CONFIG[service_name]
+    def __init__(self, respond):
+        self.respond = respond
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        thread = threading.Thread(target=self.run, name="stub-server")
+        thread.daemon = True
+        thread.start()
     
-    log_message(f"Attempting to restart {service_name}...", "WARNING")
-    returncode, stdout, stderr = execute_command(config["restart_command"])
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return  # Closed
+            with connection:
+                try:
+                    self.respond(connection)
+                except OSError:
+                    pass
     
-    if returncode == 0:
-        log_message(f"Successfully restarted {service_name}", "SUCCESS")
-        return True
-    else:
-        log_message(f"Failed to restart {service_name}: {stderr}", "ERROR")
-        return False
+    def close(self):
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)  # Wakes the blocked accept()
+        except OSError:
+            pass
+        self.listener.close()
 
-def monitor_service(service_name, interval=30):
-    service_config = SERVICES_CONFIG.get(service_name)
-    if not service_config:
-        log_message(f"Cannot monitor {service_name}: Service not configured", "ERROR")
-        return
+def stub_reply(reply):
+    def respond(connection):
+        connection.recv(65536)
+        connection.sendall(reply)
+    return respond
+
+def stub_greeting(greeting):
+    def respond(connection):
+        connection.sendall(greeting)
+    return respond
+
+def mysql_packet(payload):
+    return len(payload).to_bytes(3, "little") + b"\0" + payload
+
+# (description, probe type, extra options, stub behaviour, expected result)
+HEALTH_PROBE_SELF_TESTS = [
+    ("http 200 with expected body", "http", {"path": "/health", "expect_body": "ok"},
+     stub_reply(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"), True),
+    ("http 503", "http", {}, stub_reply(b"HTTP/1.1 503 Service Unavailable\r\n\r\n"), False),
+    ("http connection closed", "http", {}, stub_greeting(b""), False),
+    ("redis PONG", "redis", {}, stub_reply(b"+PONG\r\n"), True),
+    ("redis error", "redis", {}, stub_reply(b"-ERR unknown command\r\n"), False),
+    ("mysql greeting", "mysql", {}, stub_greeting(mysql_packet(b"\x0a8.0.36\0" + b"\0" * 40)), True),
+    ("mysql error packet", "mysql", {}, stub_greeting(mysql_packet(b"\xff\x10\x04#HY000Too many connections")), False),
+    ("mysql empty packet", "mysql", {}, stub_greeting(mysql_packet(b"")), False),
+    ("mysql truncated header", "mysql", {}, stub_greeting(b"\x05\0"), False),
+    ("postgres SSLRequest", "postgres", {}, stub_reply(b"N"), True),
+    ("postgres garbage", "postgres", {}, stub_reply(b"E"), False),
+    ("http non-string expect_body", "http", {"expect_body": 200},
+     stub_reply(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"), False),
+    ("redis non-numeric max_latency", "redis", {"max_latency": "fast"}, stub_reply(b"+PONG\r\n"), False),
+]
+
+STUB_SYSTEMCTL = """#!/bin/sh
+# Stand-in for `systemctl show -p PROPERTIES UNIT...`
+shift 3
+for unit in "$@"; do
+    case "$unit" in
+        *@.service) echo "Unit name $unit is not valid." >&2; exit 1 ;;
+        running*) printf 'LoadState=loaded\\nActiveState=active\\nSubState=running\\nMainPID=4242\\n' ;;
+        *) printf 'LoadState=not-found\\nActiveState=inactive\\nSubState=dead\\nMainPID=0\\n' ;;
+    esac
+    echo
+done
+"""
+
+def self_test_systemd_status():
+    results = []
     
-    failures = 0
-    max_failures = 3
-    restart_attempts = 0
-    max_restart_attempts = 5
+    blocks = parse_systemctl_show("LoadState=loaded\nActiveState=active\nMainPID=12\n\nLoadState=not-found\nActiveState=inactive\n")
+    passed = blocks == [{"LoadState": "loaded", "ActiveState": "active", "MainPID": "12"},
+                        {"LoadState": "not-found", "ActiveState": "inactive"}]
+    results.append(("systemctl show parsing", passed, f"{len(blocks)} unit blocks parsed"))
     
-    log_message(f"Starting monitoring for {service_name}", "INFO")
+    directory = tempfile.mkdtemp(prefix="service-monitor-systemctl-")
+    stub = os.path.join(directory, "systemctl")
+    with open(stub, "w") as f:
+        f.write(STUB_SYSTEMCTL)
+    os.chmod(stub, 0o755)
+    path = os.environ.get("PATH", "")
+    os.environ["PATH"] = directory + os.pathsep + path
     
-    while not stop_event.is_set():
-        is_running, status_msg = check_service_status(service_name)
-        
-        if is_running:
-            failures = 0
-            restart_attempts = 0
-            
-            monitored_services[service_name]["status"] = "Running"
-            monitored_services[service_name]["last_check"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            monitored_services[service_name]["failures"] = failures
-            
-            time.sleep(interval)
-            continue
+    backend = SystemdStatusBackend()
+    backend.dbus_failed = True  # Exercise the systemctl fallback
+    try:
+        try:
+            states = backend.get_unit_states(["running-web", "stopped-db"])
+            passed = (states["running-web.service"]["ActiveState"] == "active" and
+                      states["running-web.service"]["MainPID"] == "4242" and
+                      states["stopped-db.service"]["ActiveState"] == "inactive")
+            message = ", ".join(f"{unit} {state['ActiveState']}" for unit, state in sorted(states.items()))
+        except Exception as e:
+            passed, message = False, f"raised {type(e).__name__}: {str(e)}"
+        results.append(("systemctl backend, batched units", passed, message))
         
-        failures += 1
-        monitored_services[service_name]["status"] = "Failed"
-        monitored_services[service_name]["last_check"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        monitored_services[service_name]["failures"] = failures
-        
-        if failures >= max_failures:
-            if restart_attempts >= max_restart_attempts:
-                log_message(f"Service {service_name} has failed {failures} times and reached maximum restart attempts ({max_restart_attempts})", "ERROR")
-                log_message(f"Manual intervention required for {service_name}", "ERROR")
-                monitored_services[service_name]["status"] = "Failed - Manual intervention required"
-                stop_monitoring_service(service_name)
-                break
-            
-            restart_attempts += 1
-            successfully_restarted = restart_service(service_name)
-            
-            if successfully_restarted:
-                failures = 0
-                monitored_services[service_name]["status"] = "Restarted"
-                monitored_services[service_name]["last_restart"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                monitored_services[service_name]["restart_count"] += 1
-            
-            time.sleep(10)  # Give the service some time to start up before checking again
-        else:
-            log_message(f"Service {service_name} appears to be down (failure {failures}/{max_failures})", "WARNING")
-            time.sleep(interval / 2)  # Check more frequently during potential failure
+        # An invalid unit in the batch must fail only its own lookup.
+        collector = StatusBatchCollector(backend)
+        monitored_units = {"bad@.service", "running-web.service"}
+        collector._batch_units = lambda unit: (
+            [systemd_unit_name(unit)] if systemd_unit_name(unit) in collector.isolated
+            else sorted(monitored_units - collector.isolated | {systemd_unit_name(unit)}))
+        try:
+            state = collector.get_unit_state("running-web")
+            try:
+                collector.get_unit_state("bad@")
+                passed, message = False, "invalid unit did not fail"
+            except RuntimeError as e:
+                passed = state["ActiveState"] == "active"
+                message = f"running-web {state['ActiveState']}, bad@ failed: {str(e)}"
+        except Exception as e:
+            passed, message = False, f"raised {type(e).__name__}: {str(e)}"
+        results.append(("batched lookup with an invalid unit", passed, message))
+    finally:
+        os.environ["PATH"] = path
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
 
-def start_monitoring_service(service_name, interval=30):
-    if service_name in monitored_services and monitored_services[service_name]["thread"] and monitored_services[service_name]["thread"].is_alive():
-        log_message(f"Service {service_name} is already being monitored", "WARNING")
-        return False
+STUB_SSH = """#!/bin/sh
+# Stand-in for ssh: skips the options and runs the command locally.
+while [ $# -gt 2 ]; do shift; done
+exec /bin/sh -c "$2"
+"""
+
+def self_test_ssh_pool():
+    global SSH_COMMAND
+    results = []
     
-    is_running, status_msg = check_service_status(service_name)
-    initial_status = "Running" if is_running else "Not running"
+    directory = tempfile.mkdtemp(prefix="service-monitor-ssh-stub-")
+    stub = os.path.join(directory, "ssh")
+    with open(stub, "w") as f:
+        f.write(STUB_SSH)
+    os.chmod(stub, 0o755)
+    ssh_command, SSH_COMMAND = SSH_COMMAND, [stub]
+    pool = SSHConnectionPool()
     
-    monitored_services[service_name] = {
-        "thread": None,
-        "status": initial_status,
-        "last_check": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "last_restart": "Never",
-        "restart_count": 0,
-        "failures": 0,
-        "interval": interval
-    }
+    try:
+        result = pool.run("admin@db1", "echo remote-out; echo remote-err >&2; exit 3", 5)
+        passed = result == (3, "remote-out\n", "remote-err\n")
+        results.append(("ssh exit status and output", passed, f"returned {result!r}"))
+        
+        # Twice the per-host limit of 0.3s commands must take two rounds.
+        threads = [threading.Thread(target=pool.run, args=("admin@db1", "sleep 0.3", 5))
+                   for _ in range(SSH_HOST_CONCURRENCY * 2)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        passed = elapsed >= 0.6 and pool.commands["admin@db1"] == len(threads) + 1
+        results.append(("ssh per-host concurrency limit", passed,
+                        f"{len(threads)} commands with a limit of {SSH_HOST_CONCURRENCY} took {elapsed:.2f}s"))
+    finally:
+        SSH_COMMAND = ssh_command
+        if pool.control_dir:
+            shutil.rmtree(pool.control_dir, ignore_errors=True)
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def self_test_health_probes():
+    results = []
+    for description, probe_type, options, respond, expected in HEALTH_PROBE_SELF_TESTS:
+        stub = StubServer(respond)
+        config = {
+            "service_name": description,
+            "port": stub.port,
+            "health_check": dict(options, type=probe_type, host="127.0.0.1", timeout=1),
+        }
+        try:
+            healthy, message = run_health_probe(config)
+        except Exception as e:
+            healthy, message = None, f"raised {type(e).__name__}: {str(e)}"
+        finally:
+            stub.close()
+        results.append((description, healthy == expected, message))
+    return results
+
+def stub_smtp(messages):
+    def respond(connection):
+        reader = connection.makefile("rb")
+        connection.sendall(b"220 stub ESMTP\r\n")
+        for line in reader:
+            command = line[:4].upper()
+            if command == b"DATA":
+                connection.sendall(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                lines = []
+                for line in reader:
+                    if line == b".\r\n":
+                        break
+                    lines.append(line)
+                messages.append(b"".join(lines).decode())
+                connection.sendall(b"250 Queued\r\n")
+            elif command == b"QUIT":
+                connection.sendall(b"221 Bye\r\n")
+                return
+            else:
+                connection.sendall(b"250 OK\r\n")
+    return respond
+
+def self_test_notification_sinks():
+    received = {"webhook": [], "smtp": []}
     
-    thread = threading.Thread(target=monitor_service, args=(service_name, interval))
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received["webhook"].append(self.rfile.read(int(self.headers["Content-Length"])).decode())
+            self.send_response(204)
+            self.end_headers()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    webhook = HTTPServer(("127.0.0.1", 0), WebhookHandler)
+    thread = threading.Thread(target=webhook.serve_forever, name="stub-webhook")
     thread.daemon = True
     thread.start()
+    smtp = StubServer(stub_smtp(received["smtp"]))
+    syslog = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    syslog.bind(("127.0.0.1", 0))
+    syslog.settimeout(1)
+    fd, path = tempfile.mkstemp(prefix="service-monitor-notify-")
+    os.close(fd)
     
-    monitored_services[service_name]["thread"] = thread
-    log_message(f"Started monitoring service {service_name} at {interval} second intervals", "SUCCESS")
-    return True
+    subject = "1 services down"
+    body = "self-test: down: status check failed"
+    events = [("failure", "self-test", "down: status check failed", time.time())]
+    smtp_channel = {"type": "smtp", "host": "127.0.0.1", "port": smtp.port, "from": "monitor@localhost"}
+    
+    # (description, channel, fetch what the stub received, text it must contain)
+    cases = [
+        ("webhook notification", {"type": "webhook", "url": f"http://127.0.0.1:{webhook.server_address[1]}/hook"},
+         lambda: "".join(received["webhook"]), json.dumps(subject)),
+        ("smtp notification to one address", dict(smtp_channel, to="ops@example.com"),
+         lambda: "".join(received["smtp"]), "To: ops@example.com\r\n"),
+        ("smtp notification to an address list", dict(smtp_channel, to=["ops@example.com", "oncall@example.com"]),
+         lambda: "".join(received["smtp"]), "To: ops@example.com, oncall@example.com\r\n"),
+        ("syslog notification", {"type": "syslog", "host": "127.0.0.1", "port": syslog.getsockname()[1]},
+         lambda: syslog.recv(4096).decode(), f"service-monitor: {subject}"),
+        ("file notification", {"type": "file", "path": path},
+         lambda: open(path).read(), f"{subject}\n{body}\n"),
+    ]
+    
+    results = []
+    try:
+        for description, channel, fetch, expected in cases:
+            for messages in received.values():
+                messages.clear()
+            try:
+                channel = validate_notification_channels([channel])[0]
+                NOTIFICATION_SINKS[channel["type"]][0](channel, subject, body, events)
+                passed = expected in fetch()
+                message = "delivered" if passed else f"stub did not receive {expected!r}"
+            except Exception as e:
+                passed, message = False, f"raised {type(e).__name__}: {str(e)}"
+            results.append((description, passed, message))
+    finally:
+        webhook.shutdown()
+        webhook.server_close()
+        smtp.close()
+        syslog.close()
+        os.remove(path)
+    return results
 
-def stop_monitoring_service(service_name):
-    if service_name not in monitored_services or not monitored_services[service_name]["thread"]:
-        log_message(f"Service {service_name} is not currently being monitored", "WARNING")
-        return False
+def run_self_test():
+    # Exercises the protocol code against local stubs; no real services needed.
+    results = (self_test_systemd_status() + self_test_ssh_pool() + self_test_health_probes() +
+               self_test_notification_sinks())
     
-    if monitored_services[service_name]["thread"].is_alive():
-        monitored_services[service_name]["status"] = "Monitoring stopped"
-        log_message(f"Stopped monitoring service {service_name}", "INFO")
+    print(colored("SELF TEST", 'green'))
+    print(colored("-" * 70, 'white'))
+    for description, passed, message in results:
+        print(colored(f"{'PASS' if passed else 'FAIL'}  {description}: {message}", 'green' if passed else 'red'))
+    
+    failed = sum(1 for _, passed, _ in results if not passed)
+    print(colored(f"\n{len(results) - failed} passed, {failed} failed", 'green' if not failed else 'red'))
+    return failed == 0
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def render_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+def render_metrics():
+    lines = []
+    snapshot = monitored_services.snapshot()
+    
+    lines.append("# HELP service_monitor_up Whether the last check of the service passed.")
+    lines.append("# TYPE service_monitor_up gauge")
+    for data in snapshot:
+        lines.append(f'service_monitor_up{{service="{escape_label(data.name)}"}} {int(data.status == "Running")}')
+    
+    lines.append("# HELP service_monitor_consecutive_failures Failed checks since the last passing one.")
+    lines.append("# TYPE service_monitor_consecutive_failures gauge")
+    for data in snapshot:
+        lines.append(f'service_monitor_consecutive_failures{{service="{escape_label(data.name)}"}} {data.failures}')
+    
+    lines.append("# HELP service_monitor_restarts_total Successful restarts performed by the monitor.")
+    lines.append("# TYPE service_monitor_restarts_total counter")
+    for data in snapshot:
+        lines.append(f'service_monitor_restarts_total{{service="{escape_label(data.name)}"}} {data.restart_count}')
+    
+    lines.append("# HELP service_monitor_resource_usage Latest resource sample of the service's main process.")
+    lines.append("# TYPE service_monitor_resource_usage gauge")
+    for service_name, usage in sorted(resource_sampler.latest.items()):
+        for key, value in sorted(usage.items()):
+            if value is not None:
+                lines.append(f'service_monitor_resource_usage{{service="{escape_label(service_name)}",resource="{key}"}} {value}')
+    
+    lines.append("# HELP service_monitor_check_duration_seconds Time spent in each phase of a check.")
+    lines.append("# TYPE service_monitor_check_duration_seconds histogram")
+    for (service_name, phase), histogram in sorted(check_durations.items()):
+        labels = f'service="{escape_label(service_name)}",phase="{phase}"'
+        render_histogram(lines, "service_monitor_check_duration_seconds", labels, histogram)
+    
+    agents = aggregator.snapshot()
+    if agents:
+        lines.append("# HELP service_monitor_agent_connected Whether the agent currently has a connection open.")
+        lines.append("# TYPE service_monitor_agent_connected gauge")
+        for agent_id, agent in sorted(agents.items()):
+            lines.append(f'service_monitor_agent_connected{{agent="{escape_label(agent_id)}"}} {int(agent["connected"])}')
         
-        if service_name in monitored_services:
-            del monitored_services[service_name]
+        lines.append("# HELP service_monitor_agent_service_up Whether the service last reported by an agent was running.")
+        lines.append("# TYPE service_monitor_agent_service_up gauge")
+        for agent_id, agent in sorted(agents.items()):
+            for name, fields in sorted(agent["services"].items()):
+                labels = f'agent="{escape_label(agent_id)}",service="{escape_label(name)}"'
+                lines.append(f'service_monitor_agent_service_up{{{labels}}} {int(fields.get("status") == "Running")}')
+    
+    # Checks saved (the difference of these two) shrinks whenever latency drift
+    # halves an interval, so only the two monotonic totals are exported.
+    lines.append("# HELP service_monitor_adaptive_checks_total Checks run by services with adaptive intervals.")
+    lines.append("# TYPE service_monitor_adaptive_checks_total counter")
+    lines.append(f"service_monitor_adaptive_checks_total {adaptive_policy.checks_run}")
+    
+    lines.append("# HELP service_monitor_adaptive_fixed_interval_checks_total Checks the same services would have run at their fixed intervals.")
+    lines.append("# TYPE service_monitor_adaptive_fixed_interval_checks_total counter")
+    lines.append(f"service_monitor_adaptive_fixed_interval_checks_total {adaptive_policy.fixed_equivalent}")
+    
+    lines.append("# HELP service_monitor_scheduler_lag_seconds Delay between a check's deadline and its start.")
+    lines.append("# TYPE service_monitor_scheduler_lag_seconds histogram")
+    render_histogram(lines, "service_monitor_scheduler_lag_seconds", 'scheduler="main"', scheduler.lag)
+    
+    with ssh_pool.lock:
+        ssh_commands = dict(ssh_pool.commands)
+    lines.append("# HELP service_monitor_ssh_commands_total Commands run on each remote host over SSH.")
+    lines.append("# TYPE service_monitor_ssh_commands_total counter")
+    for host, count in sorted(ssh_commands.items()):
+        lines.append(f'service_monitor_ssh_commands_total{{host="{escape_label(host)}"}} {count}')
+    
+    lines.append("# HELP service_monitor_command_queue_depth Commands waiting for a free execution slot.")
+    lines.append("# TYPE service_monitor_command_queue_depth gauge")
+    lines.append(f"service_monitor_command_queue_depth {command_runner.waiting}")
+    
+    lines.append("# HELP service_monitor_commands_running Commands currently executing.")
+    lines.append("# TYPE service_monitor_commands_running gauge")
+    lines.append(f"service_monitor_commands_running {command_runner.running}")
+    
+    lines.append("# HELP service_monitor_command_timeouts_total Commands killed for exceeding their timeout.")
+    lines.append("# TYPE service_monitor_command_timeouts_total counter")
+    lines.append(f"service_monitor_command_timeouts_total {command_runner.timeouts}")
+    
+    lines.append("# HELP service_monitor_command_output_truncated_total Commands whose captured output was truncated.")
+    lines.append("# TYPE service_monitor_command_output_truncated_total counter")
+    lines.append(f"service_monitor_command_output_truncated_total {command_runner.truncated}")
+    
+    lines.append("# HELP service_monitor_command_duration_seconds Time from spawning a command to collecting its exit status.")
+    lines.append("# TYPE service_monitor_command_duration_seconds histogram")
+    with command_runner.lock:
+        render_histogram(lines, "service_monitor_command_duration_seconds", 'runner="local"', command_runner.latency)
+    
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/debug/checks":
+            payload = format_slowest_checks().encode()
+        elif path == "/metrics":
+            payload = metrics_exporter.payload
+        else:
+            self.send_error(404)
+            return
         
-        return True
-    else:
-        if service_name in monitored_services:
-            del monitored_services[service_name]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass  # Scrapes are too frequent to be worth logging
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class MetricsExporter:
+    # Scrapes are served from a payload rendered in the background, so they
+    # never wait on or lock against the monitor.
+    
+    def __init__(self):
+        self.payload = b""
+        self.server = None
+    
+    def refresh(self):
+        while not stop_event.wait(METRICS_REFRESH_INTERVAL):
+            try:
+                self.payload = render_metrics().encode()
+            except Exception as e:
+                log_message(f"Cannot render metrics: {str(e)}", "ERROR")
+    
+    def start(self, port, host="0.0.0.0"):
+        self.payload = render_metrics().encode()
+        self.server = MetricsServer((host, port), MetricsRequestHandler)
         
-        log_message(f"Monitoring thread for {service_name} was not active", "WARNING")
-        return False
+        for target in (self.server.serve_forever, self.refresh):
+            thread = threading.Thread(target=target, name="metrics-exporter")
+            thread.daemon = True
+            thread.start()
+        
+        log_message(f"Serving metrics on http://{host}:{port}/metrics", "INFO")
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+metrics_exporter = MetricsExporter()
 
 def get_available_services():
     return list(SERVICES_CONFIG.keys())
 
 def signal_handler(sig, frame):
     print(colored("\n\nShutting down service monitor...", 'yellow'))
-    stop_event.set()
+    scheduler.stop()
     sys.exit(0)
 
+def format_connect_latency(service_name):
+    config = SERVICES_CONFIG.get(service_name)
+    if not config or config["port"] is None:
+        return "-"
+    
+    histogram = port_prober.connect_latency(service_host(config), config["port"])
+    p95 = histogram.percentile(0.95) if histogram else None
+    if p95 is None:
+        return "-"
+    if p95 == float("inf"):
+        return f">{LatencyHistogram.BUCKETS[-1]}s"
+    return f"<{p95 * 1000:g}ms"
+
 def display_dashboard():
     clear_screen()
     print_ascii_art()
@@ -268,19 +3279,32 @@ def display_dashboard():
     if not monitored_services:
         print(colored("No services currently being monitored", 'yellow'))
     else:
-        print(colored("{:<15} {:<20} {:<25} {:<10}".format(
-            "SERVICE", "STATUS", "LAST CHECK", "RESTARTS"), 'cyan'))
+        print(colored("{:<15} {:<20} {:<25} {:<10} {:<12}".format(
+            "SERVICE", "STATUS", "LAST CHECK", "RESTARTS", "CONNECT P95"), 'cyan'))
         print(colored("-" * 70, 'white'))
         
-        for service, data in monitored_services.items():
-            status_color = 'green' if data["status"] == "Running" else 'red'
-            print("{:<15} {:<20} {:<25} {:<10}".format(
-                colored(service, 'white'),
-                colored(data["status"], status_color),
-                data["last_check"],
-                data["restart_count"]
+        for data in monitored_services.snapshot():
+            status_color = 'green' if data.status == "Running" else 'red'
+            print("{:<15} {:<20} {:<25} {:<10} {:<12}".format(
+                colored(data.name, 'white'),
+                colored(data.status, status_color),
+                format_timestamp(data.last_check),
+                data.restart_count,
+                format_connect_latency(data.name)
             ))
     
+    latency_summary = format_detection_latency()
+    if latency_summary:
+        print(colored(f"\nFailure detection latency: {latency_summary}", 'white'))
+    
+    if adaptive_policy.checks_run:
+        print(colored("\nAdaptive intervals: {} checks run, {:.0f} saved versus fixed intervals".format(
+            adaptive_policy.checks_run, adaptive_policy.checks_saved()), 'white'))
+    
+    if status_collector.lookups:
+        print(colored("\nUnit status lookups: {} served by {} batched queries ({} forks saved)".format(
+            status_collector.lookups, status_collector.queries, status_collector.forks_saved()), 'white'))
+    
     print(colored("\nPress Ctrl+C to exit dashboard view", 'yellow'))
 
 def add_custom_service():
@@ -316,6 +3340,8 @@ def add_custom_service():
     if not status_command:
         status_command = f"systemctl status {service_systemd_name}"
     
+    status_backend = input(colored("Query unit state directly from systemd instead of the status command? (y/N): ", 'yellow'))
+    
     SERVICES_CONFIG[service_name] = {
         "service_name": service_systemd_name,
         "port": port,
@@ -323,12 +3349,124 @@ def add_custom_service():
         "status_command": status_command,
     }
     
+    if status_backend.lower().startswith("y"):
+        SERVICES_CONFIG[service_name]["status_backend"] = "systemd"
+    
     print(colored(f"Service {service_name} added successfully", 'green'))
     input(colored("Press Enter to continue...", 'yellow'))
 
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+DASHBOARD_SORTS = ("name", "failed first", "restarts")
+
+def sparkline(values):
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    span = (high - low) or 1
+    return "".join(SPARKLINE_BLOCKS[int((value - low) / span * (len(SPARKLINE_BLOCKS) - 1))] for value in values)
+
+def arrange_snapshot(snapshot, sort_mode, filter_text):
+    if filter_text:
+        snapshot = [data for data in snapshot if filter_text.lower() in data.name.lower()]
+    if sort_mode == "failed first":
+        return sorted(snapshot, key=lambda data: (data.status == "Running", -data.failures, data.name))
+    if sort_mode == "restarts":
+        return sorted(snapshot, key=lambda data: (-data.restart_count, data.name))
+    return sorted(snapshot, key=lambda data: data.name)
+
+def draw_text(screen, y, x, text, attributes=0):
+    height, width = screen.getmaxyx()
+    if y >= height or x >= width:
+        return
+    try:
+        screen.addstr(y, x, text[:width - x - 1], attributes)
+    except curses.error:
+        pass  # Writing into the bottom-right cell raises even when the text fits
+
+def run_curses_dashboard(screen):
+    curses.curs_set(0)
+    curses.use_default_colors()
+    for pair, color in enumerate((curses.COLOR_GREEN, curses.COLOR_RED, curses.COLOR_YELLOW, curses.COLOR_CYAN), 1):
+        curses.init_pair(pair, color, -1)
+    green, red, yellow, cyan = (curses.color_pair(pair) for pair in range(1, 5))
+    screen.timeout(DASHBOARD_REFRESH_MS)
+    
+    offset = 0
+    sort_index = 0
+    filter_text = ""
+    row_format = "{:<15} {:<20} {:<20} {:>8} {:>8}  {}"
+    
+    while not stop_event.is_set():
+        rows = arrange_snapshot(monitored_services.snapshot(), DASHBOARD_SORTS[sort_index], filter_text)
+        height, width = screen.getmaxyx()
+        visible = max(1, height - 5 - DASHBOARD_LOG_LINES)
+        offset = max(0, min(offset, len(rows) - visible))
+        
+        # erase() only resets the virtual screen; refresh() then sends just
+        # the cells that changed, so nothing flickers between frames.
+        screen.erase()
+        draw_text(screen, 0, 0, "SERVICES MONITORING DASHBOARD  {}  sort: {}{}".format(
+            time.strftime("%H:%M:%S"), DASHBOARD_SORTS[sort_index],
+            f"  filter: {filter_text}" if filter_text else ""), green | curses.A_BOLD)
+        draw_text(screen, 1, 0, row_format.format("SERVICE", "STATUS", "LAST CHECK", "RESTARTS", "FAILURES", "CHECK LATENCY"), cyan)
+        
+        for line, data in enumerate(rows[offset:offset + visible], 2):
+            color = green if data.status == "Running" else red
+            draw_text(screen, line, 0, row_format.format(
+                data.name[:15], data.status[:20], format_timestamp(data.last_check),
+                data.restart_count, data.failures, sparkline(data.check_latencies)), color)
+        
+        if not rows:
+            draw_text(screen, 2, 0, "No services currently being monitored", yellow)
+        
+        # Background log output goes here rather than straight to the terminal.
+        log_colors = {"ERROR": red, "WARNING": yellow, "SUCCESS": green}
+        for line, (level, entry) in enumerate(list(recent_log_entries), height - 2 - DASHBOARD_LOG_LINES):
+            if line > 1:
+                draw_text(screen, line, 0, entry, log_colors.get(level, 0))
+        
+        draw_text(screen, height - 2, 0, f"{len(rows)} services, showing {offset + 1 if rows else 0}-{min(len(rows), offset + visible)}")
+        draw_text(screen, height - 1, 0, "q: back  up/down/PgUp/PgDn: scroll  s: sort  /: filter", yellow)
+        screen.refresh()
+        
+        key = screen.getch()
+        if key in (ord("q"), 27):
+            return
+        elif key in (curses.KEY_UP, ord("k")):
+            offset -= 1
+        elif key in (curses.KEY_DOWN, ord("j")):
+            offset += 1
+        elif key == curses.KEY_PPAGE:
+            offset -= visible
+        elif key == curses.KEY_NPAGE:
+            offset += visible
+        elif key == ord("s"):
+            sort_index = (sort_index + 1) % len(DASHBOARD_SORTS)
+        elif key == ord("/"):
+            draw_text(screen, height - 1, 0, " " * (width - 1))
+            draw_text(screen, height - 1, 0, "Filter: ", yellow)
+            curses.echo()
+            curses.curs_set(1)
+            screen.timeout(-1)
+            filter_text = screen.getstr(height - 1, 8, 40).decode("utf-8", "replace").strip()
+            curses.noecho()
+            curses.curs_set(0)
+            screen.timeout(DASHBOARD_REFRESH_MS)
+            offset = 0
+
 def live_dashboard():
     signal.signal(signal.SIGINT, signal_handler)
     
+    if curses is not None and sys.stdout.isatty():
+        console_muted.set()
+        try:
+            curses.wrapper(run_curses_dashboard)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            console_muted.clear()
+        return
+    
     try:
         while True:
             display_dashboard()
@@ -371,7 +3509,7 @@ def main_menu():
             view_log_menu()
         elif choice == '8':
             print(colored("Exiting program...", 'yellow'))
-            stop_event.set()
+            scheduler.stop()
             break
         else:
             print(colored("Invalid choice. Press Enter to continue...", 'red'))
@@ -419,11 +3557,11 @@ def stop_monitoring_menu():
     if not monitored_services:
         print(colored("No services are currently being monitored", 'yellow'))
     else:
-        services = list(monitored_services.keys())
-        for i, service in enumerate(services, 1):
-            status = monitored_services[service]["status"]
-            status_color = 'green' if status == "Running" else 'red'
-            print(colored(f"{i}. {service} - ", 'white') + colored(status, status_color))
+        snapshot = monitored_services.snapshot()
+        services = [data.name for data in snapshot]
+        for i, data in enumerate(snapshot, 1):
+            status_color = 'green' if data.status == "Running" else 'red'
+            print(colored(f"{i}. {data.name} - ", 'white') + colored(data.status, status_color))
         
         print(colored("0. Return to Main Menu", 'white'))
         
@@ -472,6 +3610,11 @@ def check_status_menu():
             print(colored(f"Status: {status}", status_color))
             print(colored("Details:", 'white'))
             print(status_msg)
+            
+            history = state_db.restarts_per_hour(service)
+            print(colored(f"\nRestarts in the last 24 hours: {sum(count for _, count in history)}", 'white'))
+            for hour, count in history:
+                print(colored(f"  {format_timestamp(hour)[:13]}:00  {count}", 'white'))
         else:
             print(colored("Invalid choice", 'red'))
     except ValueError:
@@ -506,9 +3649,11 @@ def manual_restart_menu():
             if success:
                 print(colored(f"Successfully restarted {service}", 'green'))
                 
-                if service in monitored_services:
-                    monitored_services[service]["last_restart"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    monitored_services[service]["restart_count"] += 1
+                state = monitored_services.get(service)
+                if state is not None:
+                    state.last_restart = time.time()
+                    state.restart_count += 1
+                    state_db.save_state(state)
             else:
                 print(colored(f"Failed to restart {service}", 'red'))
         else:
@@ -518,6 +3663,16 @@ def manual_restart_menu():
     
     input(colored("\nPress Enter to continue...", 'yellow'))
 
+def print_log_line(line):
+    if "[ERROR]" in line:
+        print(colored(line.strip(), 'red'))
+    elif "[WARNING]" in line:
+        print(colored(line.strip(), 'yellow'))
+    elif "[SUCCESS]" in line:
+        print(colored(line.strip(), 'green'))
+    else:
+        print(colored(line.strip(), 'white'))
+
 def view_log_menu():
     clear_screen()
     print_ascii_art()
@@ -526,38 +3681,358 @@ def view_log_menu():
     print(colored("-" * 70, 'white'))
     
     try:
-        with open(log_file, "r") as f:
-            log_content = f.readlines()
+        log_content = tail_lines(log_file, 20)
         
         if not log_content:
             print(colored("Log file is empty", 'yellow'))
         else:
             print(colored("Last 20 log entries:", 'white'))
-            for line in log_content[-20:]:
-                if "[ERROR]" in line:
-                    print(colored(line.strip(), 'red'))
-                elif "[WARNING]" in line:
-                    print(colored(line.strip(), 'yellow'))
-                elif "[SUCCESS]" in line:
-                    print(colored(line.strip(), 'green'))
-                else:
-                    print(colored(line.strip(), 'white'))
+            for line in log_content:
+                print_log_line(line)
     except FileNotFoundError:
         print(colored("Log file does not exist yet", 'yellow'))
+        input(colored("\nPress Enter to continue...", 'yellow'))
+        return
+    
+    search = input(colored("\nSearch the log? (y/N): ", 'yellow'))
+    if search.lower().startswith("y"):
+        service = input(colored("Service (leave empty for all): ", 'yellow')).strip()
+        level = input(colored("Level (INFO, SUCCESS, WARNING, ERROR; leave empty for all): ", 'yellow')).strip()
+        since = input(colored("From (YYYY-MM-DD [HH:MM:SS], leave empty for start): ", 'yellow')).strip()
+        until = input(colored("To (YYYY-MM-DD [HH:MM:SS], leave empty for now): ", 'yellow')).strip()
+        
+        # A bare date as the upper bound should include that whole day.
+        if len(until) == 10:
+            until += " 23:59:59"
+        
+        matches = query_log(service or None, level or None, since or None, until or None)
+        if not matches:
+            print(colored("No matching log entries", 'yellow'))
+        else:
+            print(colored(f"{len(matches)} matching log entries:", 'white'))
+            for line in matches:
+                print_log_line(line)
     
     input(colored("\nPress Enter to continue...", 'yellow'))
 
+class ConfigError(Exception):
+    pass
+
+CONFIG_READ_ERRORS = (OSError, ValueError) + ((yaml.YAMLError,) if yaml is not None else ())
+
+SERVICE_CONFIG_KEYS = {
+    "service_name", "port", "restart_command", "status_command", "interval", "host",
+    "port_timeout", "status_backend", "event_detection", "health_check", "restart_group",
+    "depends_on", "adaptive", "remote", "resource_limits", "pid_file", "command_timeout",
+    "restart_timeout",
+}
+
+def read_config_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    
+    if extension in (".yaml", ".yml"):
+        if yaml is None:
+            raise ConfigError(f"PyYAML is required to read {path}")
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    
+    if extension == ".toml":
+        if tomllib is None:
+            raise ConfigError(f"tomllib (Python 3.11+) or the toml package is required to read {path}")
+        with open(path, "rb") as f:
+            return tomllib.loads(f.read().decode())
+    
+    with open(path) as f:
+        return json.load(f)
+
+def validate_service_config(name, entry, defaults):
+    if not isinstance(entry, dict):
+        raise ConfigError(f"{name}: service entry must be a mapping")
+    
+    unknown = set(entry) - SERVICE_CONFIG_KEYS
+    if unknown:
+        raise ConfigError(f"{name}: unknown keys {', '.join(sorted(unknown))}")
+    
+    # Built-in services can be listed with only the keys that differ.
+    config = dict(DEFAULT_SERVICES_CONFIG.get(name, {}))
+    config.update({key: value for key, value in defaults.items() if key in SERVICE_CONFIG_KEYS})
+    config.update(entry)
+    
+    config.setdefault("service_name", name)
+    config.setdefault("port", None)
+    config.setdefault("interval", 30)
+    config.setdefault("restart_command", f"systemctl restart {config['service_name']}")
+    config.setdefault("status_command", f"systemctl status {config['service_name']}")
+    
+    port = config["port"]
+    if port is not None and (not isinstance(port, int) or isinstance(port, bool) or not 0 < port < 65536):
+        raise ConfigError(f"{name}: port must be an integer between 1 and 65535")
+    
+    for key in ("interval", "port_timeout", "command_timeout", "restart_timeout"):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            raise ConfigError(f"{name}: {key} must be a positive number")
+    
+    for key in ("service_name", "restart_command", "status_command", "host", "remote", "pid_file"):
+        if key in config and not (isinstance(config[key], str) and config[key]):
+            raise ConfigError(f"{name}: {key} must be a non-empty string")
+    
+    if config.get("status_backend", "command") not in ("command", "systemd"):
+        raise ConfigError(f"{name}: status_backend must be 'command' or 'systemd'")
+    
+    if config.get("remote") and (config.get("status_backend") == "systemd" or config.get("event_detection") or
+                                 config.get("resource_limits")):
+        raise ConfigError(f"{name}: remote services support neither the systemd status backend, event detection nor resource limits")
+    
+    limits = config.get("resource_limits")
+    if limits is not None:
+        if not isinstance(limits, dict) or set(limits) - RESOURCE_LIMIT_KEYS:
+            raise ConfigError(f"{name}: resource_limits accepts only {', '.join(sorted(RESOURCE_LIMIT_KEYS))}")
+        for key, value in limits.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ConfigError(f"{name}: resource_limits.{key} must be a positive number")
+    
+    depends_on = config.get("depends_on", [])
+    if not isinstance(depends_on, list) or not all(isinstance(dependency, str) for dependency in depends_on):
+        raise ConfigError(f"{name}: depends_on must be a list of service names")
+    if name in depends_on:
+        raise ConfigError(f"{name}: a service cannot depend on itself")
+    
+    if "restart_group" in config and not (isinstance(config["restart_group"], str) and config["restart_group"]):
+        raise ConfigError(f"{name}: restart_group must be a non-empty string")
+    
+    health_check = config.get("health_check")
+    if health_check is not None:
+        if not isinstance(health_check, dict) or health_check.get("type") not in HEALTH_PROBES:
+            raise ConfigError(f"{name}: health_check type must be one of {', '.join(sorted(HEALTH_PROBES))}")
+        
+        for key in ("path", "expect_body", "host", "host_header"):
+            if key in health_check and not (isinstance(health_check[key], str) and health_check[key]):
+                raise ConfigError(f"{name}: health_check.{key} must be a non-empty string")
+        
+        for key in ("timeout", "max_latency"):
+            value = health_check.get(key)
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+                raise ConfigError(f"{name}: health_check.{key} must be a positive number")
+        
+        probe_port = health_check.get("port")
+        if probe_port is not None and (not isinstance(probe_port, int) or isinstance(probe_port, bool) or not 0 < probe_port < 65536):
+            raise ConfigError(f"{name}: health_check.port must be an integer between 1 and 65535")
+        
+        expect_status = health_check.get("expect_status", 200)
+        statuses = expect_status if isinstance(expect_status, list) else [expect_status]
+        if not statuses or not all(isinstance(code, int) and not isinstance(code, bool) and 100 <= code < 600 for code in statuses):
+            raise ConfigError(f"{name}: health_check.expect_status must be an HTTP status code or a list of them")
+    
+    return config
+
+def validate_dependencies(services):
+    for name, config in services.items():
+        unknown = [dependency for dependency in config.get("depends_on", []) if dependency not in services]
+        if unknown:
+            raise ConfigError(f"{name}: depends_on names unknown services {', '.join(unknown)}")
+    
+    # Depth-first search; reaching a service that is still on the stack means a cycle.
+    visited = set()
+    stack = []
+    
+    def visit(name):
+        if name in stack:
+            cycle = stack[stack.index(name):] + [name]
+            raise ConfigError(f"dependency cycle {' -> '.join(cycle)}")
+        if name in visited:
+            return
+        stack.append(name)
+        for dependency in services[name].get("depends_on", []):
+            visit(dependency)
+        stack.pop()
+        visited.add(name)
+    
+    for name in services:
+        visit(name)
+
+def load_config(path):
+    try:
+        document = read_config_file(path)
+    except CONFIG_READ_ERRORS as e:
+        raise ConfigError(f"Cannot read {path}: {str(e)}")
+    
+    if not isinstance(document, dict) or not isinstance(document.get("services"), dict):
+        raise ConfigError(f"{path}: expected a top-level 'services' mapping")
+    
+    defaults = document.get("defaults", {})
+    if not isinstance(defaults, dict):
+        raise ConfigError(f"{path}: 'defaults' must be a mapping")
+    
+    services = {
+        name: validate_service_config(name, entry or {}, defaults)
+        for name, entry in document["services"].items()
+    }
+    validate_dependencies(services)
+    notifications = validate_notification_channels(document.get("notifications", []))
+    
+    metrics_port = document.get("metrics_port")
+    if metrics_port is not None and (not isinstance(metrics_port, int) or isinstance(metrics_port, bool) or
+                                     not 0 < metrics_port < 65536):
+        raise ConfigError(f"{path}: metrics_port must be an integer between 1 and 65535")
+    return {"services": services, "metrics_port": metrics_port, "notifications": notifications}
+
+def apply_config(services, keep=()):
+    # Only services whose entries changed are touched; the rest keep running
+    # with their state untouched. Services in keep were requested on the
+    # command line and stay monitored even when the file does not list them.
+    for name in [name for name in monitored_services if name not in services and name not in keep]:
+        stop_monitoring_service(name)
+        log_message(f"Service {name} removed from configuration", "INFO")
+    
+    for name, config in services.items():
+        interval = config["interval"]
+        service_config = {key: value for key, value in config.items() if key != "interval"}
+        state = monitored_services.get(name)
+        
+        if state is None:
+            SERVICES_CONFIG[name] = service_config
+            start_monitoring_service(name, interval)
+            continue
+        
+        if SERVICES_CONFIG.get(name) != service_config:
+            SERVICES_CONFIG[name] = service_config
+            if not service_config.get("event_detection"):
+                exit_watcher.unwatch(name)
+            log_message(f"Updated configuration of {name}", "INFO")
+        
+        if state.interval != interval:
+            state.interval = interval
+            scheduler.schedule(name, interval)
+            log_message(f"Changed check interval of {name} to {interval} seconds", "INFO")
+
+def reload_config(path, keep=()):
+    try:
+        config = load_config(path)
+    except ConfigError as e:
+        log_message(f"Configuration not reloaded: {str(e)}", "ERROR")
+        return False
+    
+    apply_config(config["services"], keep)
+    notifier.configure(config["notifications"])
+    log_message(f"Loaded configuration from {path}", "SUCCESS")
+    return True
+
+def config_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def run_headless(services, interval, metrics_port=None, config_path=None, agent_address=None, aggregate_address=None):
+    reload_requested = threading.Event()
+    
+    def request_stop(sig, frame):
+        log_message("Shutting down service monitor", "INFO")
+        scheduler.stop()
+    
+    def request_reload(sig, frame):
+        reload_requested.set()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGHUP, request_reload)
+    
+    if config_path:
+        try:
+            config = load_config(config_path)
+        except ConfigError as e:
+            log_message(f"Invalid configuration: {str(e)}", "ERROR")
+            return False
+        apply_config(config["services"], services)
+        notifier.configure(config["notifications"])
+        metrics_port = metrics_port or config["metrics_port"]
+    
+    for service_name in services:
+        if service_name in monitored_services:
+            continue  # Also declared in the config file, which takes precedence
+        if service_name not in SERVICES_CONFIG:
+            log_message(f"Cannot monitor {service_name}: Service not configured", "ERROR")
+            continue
+        start_monitoring_service(service_name, interval)
+    
+    if aggregate_address:
+        aggregator.start(aggregate_address)
+    if agent_address:
+        AgentPublisher(agent_address, socket.gethostname()).start()
+    if metrics_port:
+        metrics_exporter.start(metrics_port)
+    
+    # The config file is polled for changes alongside SIGHUP; the standard
+    # library has no inotify binding and a one second stat() is negligible.
+    last_mtime = config_mtime(config_path) if config_path else None
+    while not stop_event.wait(1):
+        if not config_path:
+            continue
+        
+        mtime = config_mtime(config_path)
+        if reload_requested.is_set() or mtime != last_mtime:
+            reload_requested.clear()
+            last_mtime = mtime
+            reload_config(config_path, services)
+    
+    metrics_exporter.stop()
+    return True
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Service Monitor & Auto-Restarter")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the interactive menu")
+    parser.add_argument("--services", default="",
+                        help="comma separated services to monitor in headless mode")
+    parser.add_argument("--interval", type=int, default=30,
+                        help="check interval in seconds for headless mode (default: 30)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port")
+    parser.add_argument("--config", default=None,
+                        help="JSON, YAML or TOML file declaring the services to monitor "
+                             "(headless mode; reloaded on SIGHUP or when the file changes)")
+    parser.add_argument("--agent", metavar="ADDRESS", default=None,
+                        help="push state changes to an aggregator at host:port or unix:/path (headless mode)")
+    parser.add_argument("--aggregate", metavar="ADDRESS", default=None,
+                        help="accept agent connections on host:port or unix:/path (headless mode)")
+    parser.add_argument("--agent-load-test", metavar="AGENTS", type=int, default=None,
+                        help="run a loopback load test with this many synthetic agents and exit")
+    parser.add_argument("--benchmark", metavar="SERVICES", type=int, default=None,
+                        help="monitor this many synthetic failing services (checked every --interval seconds) and report throughput and latency")
+    parser.add_argument("--benchmark-duration", type=int, default=30,
+                        help="benchmark duration in seconds (default: 30)")
+    parser.add_argument("--self-test", action="store_true",
+                        help="run the systemd status backend, SSH pool, health probes and notification channels against local stubs and exit")
+    return parser.parse_args()
+
 if __name__ == "__main__":
     try:
         if not os.path.exists(log_file):
             with open(log_file, "w") as f:
                 f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} [INFO] Service monitor started\n")
         
+        arguments = parse_arguments()
+        register_debug_signals()
         log_message("Service monitor started", "INFO")
-        main_menu()
+        
+        if arguments.self_test:
+            sys.exit(0 if run_self_test() else 1)
+        elif arguments.agent_load_test:
+            run_agent_load_test(arguments.agent_load_test)
+        elif arguments.benchmark:
+            run_benchmark(arguments.benchmark, arguments.benchmark_duration, arguments.interval)
+        elif arguments.headless:
+            services = [name.strip() for name in arguments.services.split(",") if name.strip()]
+            run_headless(services, arguments.interval, arguments.metrics_port, arguments.config,
+                         arguments.agent, arguments.aggregate)
+        else:
+            if arguments.metrics_port:
+                metrics_exporter.start(arguments.metrics_port)
+            main_menu()
     except KeyboardInterrupt:
         print(colored("\nProgram terminated by user", 'yellow'))
-        stop_event.set()
+        scheduler.stop()
     except Exception as e:
         print(colored(f"\nAn error occurred: {str(e)}", 'red'))
         log_message(f"Fatal error: {str(e)}", "ERROR")